@@ -0,0 +1,321 @@
+# File: aiopilot.py
+
+# asyncio runtime for the autopilot.
+#
+# Instead of blocking while-loops around maintain(), the flight plan is a
+# coroutine that awaits conditions on the instruments:
+#
+#     await pilot.until(lambda i: i.alt_agl < 300, law)
+#
+# Control runs first: every datagram is decoded, the active control law is
+# applied and the commands are sent from the DatagramProtocol callback.
+# Background jobs only start between datagrams, in priority order.
+# Non-blocking jobs run on the loop thread, so they must be quick: a job
+# that takes 50 ms delays the next datagram by 50 ms. Blocking jobs (disk
+# writes) each run as their own task in a worker thread, so a slow one
+# delays neither the control output nor the other jobs. Slow UI redraws
+# belong in another process reading a statebus.StateBus (see build_ui in
+# autopilot-async.py).
+
+import asyncio
+import copy
+import heapq
+
+from datagroups import compile_packer
+from xplane import AUTOPILOT_IP, AUTOPILOT_PORT, XPLANE_PORT, Controls, Receiver
+
+
+PRIORITY_UI     = 1
+PRIORITY_RECORD = 2
+PRIORITY_LOW    = 3
+
+
+class SimulationStart(Exception):
+
+    def __init__(self):
+        pass
+
+
+class XPlaneProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, pilot):
+        self.pilot = pilot
+
+    def connection_made(self, transport):
+        self.pilot.connection_made(transport)
+
+    def datagram_received(self, data, addr):
+        self.pilot.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        self.pilot.errors += 1
+
+
+# A job run periodically between datagrams
+
+class Job:
+
+    def __init__(self, period, fn, priority, blocking):
+
+        # period: seconds between runs
+        # fn: called with the current Instruments and Controls
+        # priority: lower runs first when several jobs are due
+        # blocking: run fn in a worker thread on a snapshot of the state
+
+        self.period = period
+        self.fn = fn
+        self.priority = priority
+        self.blocking = blocking
+        self.runs = 0
+        self.late = 0     # runs started after their next due time
+        self.skipped = 0  # blocking runs skipped, the last still running
+        self.errors = 0   # blocking runs that raised
+        self.pending = None
+
+
+# Flies one aircraft from one UDP port
+
+class Pilot:
+
+    def __init__(self, ip=AUTOPILOT_IP, port=AUTOPILOT_PORT,
+                 xplane_port=XPLANE_PORT, bus=None):
+
+        # bus: statebus.StateBus receiving the state after every datagram,
+        #      for readers in other processes (optional)
+
+        self.address = (ip, port)
+        self.xplane_port = xplane_port
+        self.transport = None
+        self.receiver = None
+        self.controls = Controls()
+        self.pack = compile_packer()[0]
+        self.errors = 0
+        self.bus = bus
+
+        self.predicate = None  # exit condition of the current phase
+        self.law = None        # control law of the current phase
+        self.future = None     # resolved when the phase ends
+        self.restart = True    # raise SimulationStart on crash/reset
+
+        self.jobs = []
+        self.background = None
+
+    @property
+    def instruments(self):
+        return self.receiver.front
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: XPlaneProtocol(self),
+                                            local_addr=self.address)
+        self.background = asyncio.ensure_future(self._run_jobs())
+
+    def close(self):
+        if self.background is not None:
+            self.background.cancel()
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.receiver = Receiver(sock=transport.get_extra_info('socket'))
+
+    def datagram_received(self, data, addr):
+
+        # Control path: decode, end the phase or apply its law, send. An
+        # error in the predicate or the law fails the phase (fly() gets the
+        # exception) and the commands are still sent.
+
+        receiver = self.receiver
+        receiver.peer = addr
+        instr = receiver.feed(data)
+        controls = self.controls
+
+        future = self.future
+        if future is not None and not future.done():
+            try:
+                if self.restart and instr.mph < 1 and instr.alt_agl < 50:
+                    future.set_exception(SimulationStart())
+                elif self.predicate(instr):
+                    future.set_result(instr)
+                elif self.law is not None:
+                    self.law(instr, controls)
+            except Exception as error:
+                future.set_exception(error)
+
+        self.transport.sendto(self.pack(controls),
+                              (addr[0], self.xplane_port))
+        if self.bus is not None:
+            self.bus.publish(instr, controls)
+
+    def until(self, predicate, law=None, restart=True):
+
+        # Returns an awaitable that completes on the first packet where
+        # predicate(instruments) is true. Until then law(instruments,
+        # controls) runs on every packet before the commands are sent.
+
+        # restart: fail with SimulationStart when the plane stops on the
+        #          ground (crash or reset), like maintain()
+
+        self.predicate = predicate
+        self.law = law
+        self.restart = restart
+        self.future = asyncio.get_running_loop().create_future()
+        return self.future
+
+    def tick(self, restart=True):
+
+        # Awaitable completing on the next packet
+
+        return self.until(lambda i: True, restart=restart)
+
+    def every(self, period, fn, priority=PRIORITY_LOW, blocking=False):
+
+        # Runs fn(instruments, controls) every period seconds between
+        # datagrams. Use blocking=True for jobs doing I/O or taking more
+        # than a fraction of a millisecond: they get a copy of the state
+        # and run in a worker thread, at most one run per job at a time.
+
+        job = Job(period, fn, priority, blocking)
+        self.jobs.append(job)
+        return job
+
+    async def _run_jobs(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        queue = [(now + job.period, job.priority, n, job)
+                 for n, job in enumerate(self.jobs)]
+        heapq.heapify(queue)
+        added = len(self.jobs)
+        while True:
+            if added < len(self.jobs):
+                for n in range(added, len(self.jobs)):
+                    job = self.jobs[n]
+                    heapq.heappush(queue, (loop.time() + job.period,
+                                           job.priority, n, job))
+                added = len(self.jobs)
+            if not queue:
+                await asyncio.sleep(0.1)
+                continue
+
+            due, priority, n, job = queue[0]
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, 0.1))
+                continue
+
+            heapq.heapreplace(queue, (due + job.period, priority, n, job))
+            if loop.time() > due + job.period:
+                job.late += 1
+            if self.receiver is not None:
+                if not job.blocking:
+                    job.fn(self.instruments, self.controls)
+                    job.runs += 1
+                elif job.pending is not None and not job.pending.done():
+                    job.skipped += 1
+                else:
+                    job.pending = loop.run_in_executor(
+                        None, job.fn, copy.copy(self.instruments),
+                        copy.copy(self.controls))
+                    job.pending.add_done_callback(
+                        lambda future, job=job: self._job_done(job, future))
+
+            # let queued datagrams through before the next job
+            await asyncio.sleep(0)
+
+    def _job_done(self, job, future):
+        if future.cancelled():
+            return
+        job.runs += 1
+        if future.exception() is not None:
+            job.errors += 1
+
+    async def run(self, fly):
+
+        # Flies fly(pilot) forever, restarting it when the simulation is
+        # reset, like autopilot(). Any other error, such as one raised by a
+        # control law, stops the pilot.
+
+        await self.start()
+        try:
+            while True:
+                print('*** start of simulation ***')
+                self.controls = Controls()
+                try:
+                    await fly(self)
+                except SimulationStart:
+                    pass
+                self.predicate = self.law = self.future = None
+        finally:
+            self.close()
+
+
+def run(fly, **kwargs):
+    asyncio.run(Pilot(**kwargs).run(fly))
+
+
+if __name__ == '__main__':
+    import socket
+    import struct
+    import time
+    from xplane import sample_packet
+
+    # Drive a pilot over the loopback interface with a fake X-Plane
+
+    async def fly(pilot):
+        def law(i, c):
+            c.ailrn = -i.roll / 50
+        await pilot.until(lambda i: i.kias >= 160, law)
+        return 'done'
+
+    async def check():
+        pilot = Pilot(ip='127.0.0.1', port=0)
+        await pilot.start()
+        rows = []
+        pilot.every(0.01, lambda i, c: rows.append(i.kias), PRIORITY_RECORD,
+                    blocking=True)
+        slow = pilot.every(0.01, lambda i, c: time.sleep(0.2), PRIORITY_UI,
+                           blocking=True)
+        xplane = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        xplane.bind(('127.0.0.1', 0))
+        xplane.setblocking(False)
+        pilot.xplane_port = xplane.getsockname()[1]
+        target = pilot.transport.get_extra_info('sockname')
+        task = asyncio.ensure_future(fly(pilot))
+        step = 0
+        while not task.done():
+            xplane.sendto(sample_packet(step), target)
+            step += 1
+            await asyncio.sleep(0.001)
+        assert task.result() == 'done' and pilot.instruments.kias >= 160
+        await asyncio.sleep(0.05)
+        reply = xplane.recv(4096) # answer to the first packet, roll -2
+        ailrn = struct.unpack_from('<f', reply, 5 + 36 + 4 + 4)[0]
+        assert abs(ailrn - 0.04) < 1e-6, ailrn
+        assert rows, 'recording job did not run'
+        # The 200 ms job ran at most once, without holding up the other
+        assert slow.skipped > 0 and slow.runs <= 1 and len(rows) > 3, \
+            (len(rows), slow.runs, slow.skipped)
+
+        # A law that raises fails the phase; the packet is still answered
+
+        def broken(i, c):
+            c.ailrn = 1 / 0
+        future = pilot.until(lambda i: False, broken)
+        while True: # drop the answers to the earlier packets
+            try:
+                xplane.recv(4096)
+            except BlockingIOError:
+                break
+        xplane.sendto(sample_packet(step), target)
+        try:
+            await asyncio.wait_for(future, 1.0)
+            raise AssertionError('the law error was swallowed')
+        except ZeroDivisionError:
+            pass
+        await asyncio.sleep(0.01)
+        assert len(xplane.recv(4096)) > 5
+        pilot.close()
+        print('flew {0} packets, recorded {1} rows'.format(step, len(rows)))
+
+    asyncio.run(check())
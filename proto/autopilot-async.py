@@ -0,0 +1,213 @@
+#! /usr/bin/python3
+
+# File: autopilot-async.py
+
+# The flight of autopilot-landing.py on the asyncio runtime: each
+# "while cond: ...; maintain()" loop became one await of pilot.until().
+
+
+import sys
+from aiopilot import Pilot, PRIORITY_RECORD
+from xplane import AUTOPILOT_IP, AUTOPILOT_PORT
+
+
+def hding_diff(hding1, hding2):
+    return (hding1 - hding2 + 180) % 360 - 180
+
+
+def turn(i, c, roll, elev):
+    err = roll - i.roll
+    c.ailrn = err / 50
+    c.elev = elev - i.roll / 100
+
+
+def hold(hding, elev):
+
+    # Control law keeping the heading hding with elevator elev
+
+    def law(i, c):
+        turn(i, c, -hding_diff(i.hding_true, hding), elev)
+    return law
+
+
+def roll_at(roll, elev):
+    def law(i, c):
+        turn(i, c, roll, elev)
+    return law
+
+
+def throttle(c, x):
+    c.thro1 = x
+    c.thro2 = x
+    c.thro3 = x
+    c.thro4 = x
+
+
+async def fly(pilot):
+
+    c = pilot.controls
+
+    print('apply full throttle and lower flaps partially')
+
+    throttle(c, 1) # full throttle
+
+    c.ruddr = -0.005 # left rudder
+    c.ailrn = -0.015 # slight left roll
+
+    c.flap = 0.25 # partial flaps
+    c.sbrak = 0 # no speed brakes
+
+    # wait to reach rotate speed
+    await pilot.until(lambda i: i.kias >= 160, restart=False)
+
+    print('start takeoff rotation')
+
+    takeoff_hding = pilot.instruments.hding_true
+    inv_hding = (takeoff_hding + 180) % 360 # inverse heading
+
+    await pilot.until(lambda i: i.kias >= 180, hold(takeoff_hding, 0.5))
+
+    print('end takeoff rotation')
+
+    await pilot.until(lambda i: i.alt_agl >= 100, hold(takeoff_hding, 0.3))
+
+    print('raise landing gear')
+
+    c.gear = 0 # raise landing gear
+    c.flap = 0 # raise flaps
+
+    await pilot.until(lambda i: i.alt_agl >= 1000, hold(takeoff_hding, 0))
+
+    print('reduce throttle and wait until 2000 feet')
+
+    throttle(c, 0.4) # ease off on throttle
+
+    await pilot.until(lambda i: i.alt_agl >= 2000, hold(takeoff_hding, 0))
+
+    print('level off')
+
+    await pilot.until(lambda i: i.pitch <= 0, hold(takeoff_hding, -0.2))
+
+    print('do a half turn')
+
+    await pilot.until(lambda i: abs(hding_diff(i.hding_true, inv_hding)) <= 2,
+                      roll_at(-30, 0))
+
+    print('maintain heading')
+
+    await pilot.until(lambda i: i.lat >= 47.51, hold(inv_hding, 0))
+
+    print('apply flaps and turn onto final approach')
+
+    throttle(c, 0.14) # ease off on throttle
+    c.flap = 0.4 # partial flaps
+
+    await pilot.until(
+        lambda i: abs(hding_diff(i.hding_true, takeoff_hding)) <= 2,
+        roll_at(-29, -0.2))
+
+    print('lower landing gears and descend to runway')
+
+    c.gear = 1 # lower landing gear
+    c.flap = 0.6 # more flaps
+
+    await pilot.until(lambda i: i.alt_agl <= 300, hold(takeoff_hding, 0))
+
+    print('start landing flare')
+
+    c.flap = 0.75 # more flaps
+
+    await pilot.until(lambda i: i.alt_agl <= 250, hold(takeoff_hding, 0.29))
+
+    print('increase landing flare')
+
+    throttle(c, 0) # min throttle
+
+    await pilot.until(lambda i: i.alt_agl <= 120, hold(takeoff_hding, 0.31))
+
+    print('finish landing flare')
+
+    await pilot.until(lambda i: i.alt_agl <= 60, hold(takeoff_hding, 0.33))
+
+    print('wait for landing')
+
+    await pilot.until(lambda i: i.alt_agl <= 2, hold(takeoff_hding, 0.39))
+
+    print('apply speed brakes')
+
+    c.sbrak = 1 # full speed brakes
+
+    await pilot.until(lambda i: i.kias <= 120, hold(takeoff_hding, 0.39))
+
+    print('apply wheel brakes')
+
+    c.wbrak = 1 # full wheel brakes
+    c.lbrak = 1
+    c.rbrak = 1
+
+    await pilot.until(lambda i: False, hold(takeoff_hding, 0.39))
+
+
+def _dashboard(name, period):
+
+    # Dashboard process: redraws from the state bus every period seconds,
+    # so a slow canvas draw never delays the control loop
+
+    import time
+    from collections import deque
+    from flightinfo import DashBoard
+    from statebus import StateReader
+
+    dash = DashBoard('KIAS', ylims=[0, 400])
+    dash.add('ALT_AGL', ylims=[0, 3000])
+    dash.add('PITCH', ylims=[-90, 90])
+    dash.add('ROLL', ylims=[-90, 90])
+
+    reader = StateReader(name, untrack=False)
+    last = None
+    while True:
+        if reader.sequence() != last:
+            i, c, last = reader.read()
+            dash.update_all(deque([i.mph, i.alt_agl, i.pitch, i.roll]))
+        time.sleep(period)
+
+
+def build_ui(pilot, period=0.1):
+    import multiprocessing
+    from statebus import StateBus
+
+    if pilot.bus is None:
+        pilot.bus = StateBus()
+    ui = multiprocessing.Process(target=_dashboard,
+                                 args=(pilot.bus.name, period), daemon=True)
+    ui.start()
+    return ui
+
+
+def build_recorder(pilot, path):
+    log = open(path, 'a')
+
+    def record(i, c):
+        log.write('{0} {1} {2} {3} {4} {5}\n'.format(
+            i.time, i.kias, i.alt_agl, i.pitch, i.roll, i.hding_true))
+        log.flush()
+
+    pilot.every(0.05, record, PRIORITY_RECORD, blocking=True)
+
+
+async def main():
+    pilot = Pilot(AUTOPILOT_IP, AUTOPILOT_PORT)
+    #Uncomment the next line if you want to run with the UI
+    #build_ui(pilot)
+    if len(sys.argv) > 1:
+        build_recorder(pilot, sys.argv[1])
+    try:
+        await pilot.run(fly)
+    finally:
+        if pilot.bus is not None:
+            pilot.bus.close()
+
+
+if __name__ == '__main__':
+    import asyncio
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+#! /usr/bin/python3
+
+# File: autopilot-phases.py
+
+# The flight of autopilot-landing.py as a phase table: each
+# "while cond: ...; maintain()" loop became one Phase, with the actions
+# before the loop as its entry action and the loop condition inverted as
+# its exit predicate. With --low-latency the rotation and flare phases are
+# flown without garbage collection pauses (see lowlatency.py), and
+# --realtime[=cpu] [--mlock] runs the loop in real-time mode (realtime.py).
+# --predict flies on instruments extrapolated over the loop latency
+# (predictor.py, with the kernel receive stamps), --estimate on Kalman-filtered ones (estimator.py).
+
+
+import sys
+
+from estimator import KalmanEstimator
+from lowlatency import GCGuard
+from realtime import from_args as realtime_args
+from phases import Flight, Phase, run
+from predictor import Predictor
+from xplane import TIME_HOST, TIME_KERNEL, Receiver, Sender
+
+
+def hding_diff(hding1, hding2):
+    return (hding1 - hding2 + 180) % 360 - 180
+
+
+def turn(i, c, roll, elev):
+    err = roll - i.roll
+    c.ailrn = err / 50
+    c.elev = elev - i.roll / 100
+
+
+def hold(heading, elev):
+
+    # Control law keeping the heading stored in vars under heading, with
+    # elevator elev
+
+    def law(i, c, f):
+        turn(i, c, -hding_diff(i.hding_true, f.vars[heading]), elev)
+    return law
+
+
+def roll_at(roll, elev):
+    def law(i, c, f):
+        turn(i, c, roll, elev)
+    return law
+
+
+def throttle(x):
+    def enter(i, c, f):
+        c.thro1 = c.thro2 = c.thro3 = c.thro4 = x
+    return enter
+
+
+def actions(*fns):
+    def enter(i, c, f):
+        for fn in fns:
+            fn(i, c, f)
+    return enter
+
+
+def setting(**values):
+    def enter(i, c, f):
+        for name, value in values.items():
+            setattr(c, name, value)
+    return enter
+
+
+def takeoff_headings(i, c, f):
+    f.vars['takeoff_hding'] = i.hding_true
+    f.vars['inv_hding'] = (i.hding_true + 180) % 360 # inverse heading
+
+
+plan = [
+    Phase('apply full throttle and lower flaps partially',
+          lambda i, f: i.kias >= 160, # wait to reach rotate speed
+          enter=actions(throttle(1),
+                        setting(ruddr=-0.005, # left rudder
+                                ailrn=-0.015, # slight left roll
+                                flap=0.25,    # partial flaps
+                                sbrak=0)),    # no speed brakes
+          restart=False),
+
+    Phase('start takeoff rotation',
+          lambda i, f: i.kias >= 180, hold('takeoff_hding', 0.5),
+          enter=takeoff_headings, critical=True),
+
+    Phase('end takeoff rotation',
+          lambda i, f: i.alt_agl >= 100, hold('takeoff_hding', 0.3),
+          critical=True),
+
+    Phase('raise landing gear',
+          lambda i, f: i.alt_agl >= 1000, hold('takeoff_hding', 0),
+          enter=setting(gear=0, flap=0)),
+
+    Phase('reduce throttle and wait until 2000 feet',
+          lambda i, f: i.alt_agl >= 2000, hold('takeoff_hding', 0),
+          enter=throttle(0.4)),
+
+    Phase('level off',
+          lambda i, f: i.pitch <= 0, hold('takeoff_hding', -0.2)),
+
+    Phase('do a half turn',
+          lambda i, f: abs(hding_diff(i.hding_true, f.vars['inv_hding'])) <= 2,
+          roll_at(-30, 0)),
+
+    Phase('maintain heading',
+          lambda i, f: i.lat >= 47.51, hold('inv_hding', 0)),
+
+    Phase('apply flaps and turn onto final approach',
+          lambda i, f:
+              abs(hding_diff(i.hding_true, f.vars['takeoff_hding'])) <= 2,
+          roll_at(-29, -0.2),
+          enter=actions(throttle(0.14), setting(flap=0.4))),
+
+    Phase('lower landing gears and descend to runway',
+          lambda i, f: i.alt_agl <= 300, hold('takeoff_hding', 0),
+          enter=setting(gear=1, flap=0.6)),
+
+    Phase('start landing flare',
+          lambda i, f: i.alt_agl <= 250, hold('takeoff_hding', 0.29),
+          enter=setting(flap=0.75), critical=True),
+
+    Phase('increase landing flare',
+          lambda i, f: i.alt_agl <= 120, hold('takeoff_hding', 0.31),
+          enter=throttle(0), critical=True),
+
+    Phase('finish landing flare',
+          lambda i, f: i.alt_agl <= 60, hold('takeoff_hding', 0.33),
+          critical=True),
+
+    Phase('wait for landing',
+          lambda i, f: i.alt_agl <= 2, hold('takeoff_hding', 0.39),
+          critical=True),
+
+    Phase('apply speed brakes',
+          lambda i, f: i.kias <= 120, hold('takeoff_hding', 0.39),
+          enter=setting(sbrak=1)),
+
+    Phase('apply wheel brakes',
+          lambda i, f: False, hold('takeoff_hding', 0.39),
+          enter=setting(wbrak=1, lbrak=1, rbrak=1)),
+]
+
+
+if __name__ == '__main__':
+    # The predictor measures the age of the data from the kernel stamps;
+    # host stamps are taken right before the law runs
+
+    predict = '--predict' in sys.argv
+    receiver = Receiver(time_source=TIME_KERNEL if predict else TIME_HOST)
+    sender = Sender()
+    realtime = realtime_args(sys.argv)
+    if realtime is not None:
+        realtime.enter(measure=True)
+        print(realtime.report())
+    guard = None
+    if '--low-latency' in sys.argv:
+        guard = GCGuard()
+        guard.start()
+    predictor = Predictor() if predict else None
+    estimator = KalmanEstimator() if '--estimate' in sys.argv else None
+    flight = Flight(plan, guard=guard)
+    try:
+        run(flight, receiver, sender, predictor, estimator)
+    except KeyboardInterrupt:
+        print(flight.report())
+        if predictor is not None:
+            print(predictor.report())
+        if guard is not None:
+            print(guard.report())
@@ -8,7 +8,10 @@ import socket
 import struct
 import sys
 import copy
-import time
+from clock import platform_time
+from datagroups import (compile_packer, compile_setters, control_groups,
+                        instrument_groups)
+from realtime import from_args as realtime_args
 from flightinfo import DashBoard
 from geodetic import Location, LatLon
 from airports import runway_heading, runway_length, runway_location, closest_runway
@@ -19,13 +22,6 @@ AUTOPILOT_PORT = 50000
 XPLANE_PORT    = 49000
 
 
-def platform_time():
-    if sys.platform == 'win32' or sys.platform == 'cygwin':
-        return time.clock()
-    else:
-        return time.time()
-
-
 class Instruments:
 
     def __init__(self):
@@ -133,6 +129,12 @@ def update_ui(data):
 
 msg_label_struct = struct.Struct('=5s')
 data_packet_struct = struct.Struct('I8f')
+group_id_struct = struct.Struct('I')
+
+# One generated setter per received DATA group (see datagroups.py)
+
+setters = compile_setters(dict((id, instrument_groups[id])
+                               for id in (3, 13, 17, 20)))
 
 
 receive_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -161,8 +163,10 @@ def receive():
     if label == 'DATA@':
         i = msg_label_struct.size;
         while i < n:
-            data = data_packet_struct.unpack_from(msg, i)
-            process_xplane_data(data, instr)
+            (id,) = group_id_struct.unpack_from(msg, i)
+            setter = setters.get(id)
+            if setter is not None:
+                setter(instr, msg, i + group_id_struct.size)
             i += data_packet_struct.size
 
     instruments = instr
@@ -170,49 +174,9 @@ def receive():
     update_ui(dash_inst)
     
 
-def process_xplane_data(data, instr):
-
-    (id, v0, v1, v2, v3, v4, v5, v6, v7) = data
-
-    if id == 3: # speeds
-
-        instr.kias       = v0
-        instr.keas       = v1
-        instr.ktas       = v2
-        instr.ktgs       = v3
-        instr.mph        = v5
-        instr.mphas      = v6
-        instr.mphgs      = v7
-
-    elif id == 13: # trim/flap/speed brakes
-
-        instr.trim_elev  = v0
-        instr.trim_ailrn = v1
-        instr.trim_ruddr = v2
-        instr.flap_handl = v3
-        instr.flap_postn = v4
-        instr.slat_ratio = v5
-        instr.sbrak_handl= v6
-        instr.sbrak_postn= v7
-
-    elif id == 17: # pitch/roll/heading
-
-        instr.pitch      = v0
-        instr.roll       = v1
-        instr.hding_true = v2
-        instr.hding_mag  = v3
-
-    elif id == 20: # lat/long/alt
-
-        instr.lat        = v0
-        instr.lon        = v1
-        instr.alt_msl    = v2
-        instr.alt_agl    = v3
-        instr.on_rwy     = v4
-        instr.alt_ind    = v5
-
-
-controls_struct = struct.Struct('=5sI8fI8fI8fI8fI8f')
+# The control datagram, laid out from the registry (see datagroups.py)
+pack_controls = compile_packer([group for group in control_groups
+                                if group.id in (14, 8, 11, 13, 25)])[0]
 
 send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -225,15 +189,7 @@ class SimulationStart(Exception):
 
 def send():
 
-    c = controls
-
-    packet = controls_struct.pack(
-                 'DATA@',
-                 14, c.gear, c.wbrak, c.lbrak, c.rbrak, 0, 0, 0, 0,
-                  8, c.elev, c.ailrn, c.ruddr, -999, c.nose, -999, -999, -999,
-                 11, -999, -999, -999, -999, c.nose, -999, -999, -999,
-                 13, c.trim_elev, c.trim_ailrn, c.trim_ruddr, c.flap, -999, -999, c.sbrak, -999,
-                 25, c.thro1, c.thro2, c.thro3, c.thro4, 0, 0, 0, 0);
+    packet = pack_controls(controls)
 
     send_sock.sendto(packet, (xplane_ip, XPLANE_PORT))
 
@@ -350,4 +306,8 @@ def fly():
 if __name__ == '__main__':
     #Uncomment the next line if you want to run with the UI
     #build_ui()
+    realtime = realtime_args(sys.argv) # --realtime[=cpu] [--mlock]
+    if realtime is not None:
+        realtime.enter(measure=True)
+        print realtime.report()
     autopilot()
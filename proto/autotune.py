@@ -0,0 +1,236 @@
+# File: autotune.py
+
+# Relay auto-tuning of the PID channels (Astrom-Hagglund).
+#
+# Instead of a PID, a relay drives the control: bias + amplitude while
+# the error is positive, bias - amplitude while it is negative, with a
+# little hysteresis against noise. Almost any aircraft axis then settles
+# into a limit cycle at its ultimate period Pu, with a process amplitude a
+# giving the ultimate gain Ku = 4 d / (pi sqrt(a^2 - eps^2)). A few cycles
+# in one short flight segment are enough; the Ziegler-Nichols style rules
+# below turn (Ku, Pu) into gains, and write_gains() stores them.
+#
+#     tuner = RelayTuner(CHANNELS['roll'])
+#     Phase('tune roll', lambda i, f: tuner.done, tuner.law)
+
+import json
+import math
+
+
+# Tuning rules: (Kp / Ku, Ti / Pu, Td / Pu), Ti None for no integral
+
+RULES = {
+    'p':              (0.5,  None, 0.0),
+    'pi':             (0.45, 0.83, 0.0),
+    'pid':            (0.6,  0.5,  0.125),
+    'some-overshoot': (0.33, 0.5,  0.33),
+    'no-overshoot':   (0.2,  0.5,  0.33),
+}
+
+
+def hding_diff(hding1, hding2):
+    return (hding1 - hding2 + 180) % 360 - 180
+
+
+# What to tune: the measured field, the driven control and the relay
+
+class Channel:
+
+    def __init__(self, name, field, controls, setpoint, amplitude,
+                 hysteresis, bias=0.0, error=None):
+
+        # field: Instruments field measured
+        # controls: Controls fields driven (all get the same value)
+        # setpoint: value the relay oscillates around; None to hold the
+        #           value found when tuning starts
+        # amplitude: relay half-swing d, in control units
+        # hysteresis: error band eps in which the relay keeps its side
+        # bias: control value the relay swings around
+        # error: error(setpoint, process), setpoint - process by default
+
+        self.name = name
+        self.field = field
+        self.controls = controls
+        self.setpoint = setpoint
+        self.amplitude = amplitude
+        self.hysteresis = hysteresis
+        self.bias = bias
+        self.error = error
+
+
+CHANNELS = {
+    'heading':  Channel('heading', 'hding_true', ('ruddr',), None, 0.05, 0.5,
+                        error=hding_diff),
+    'roll':     Channel('roll', 'roll', ('ailrn',), 0.0, 0.1, 0.5),
+    'altitude': Channel('altitude', 'alt_msl',
+                        ('thro1', 'thro2', 'thro3', 'thro4'), None, 0.2, 5.0,
+                        bias=0.5),
+}
+
+
+class RelayTuner:
+
+    def __init__(self, channel, cycles=4, skip=1, max_time=120.0):
+
+        # channel: Channel to tune
+        # cycles: full oscillations measured
+        # skip: first oscillations ignored while the cycle settles
+        # max_time: seconds after which tuning fails
+
+        self.channel = channel
+        self.cycles = cycles
+        self.skip = skip
+        self.max_time = max_time
+        self.reset()
+
+    def reset(self):
+        self.setpoint = self.channel.setpoint
+        self.output = self.channel.bias
+        self.high = None       # relay side, True for bias + amplitude
+        self.start = None
+        self.rises = []        # times the relay switched up
+        self.peaks = []        # process extremes of each half cycle
+        self.extreme = None
+        self.done = False
+        self.failed = False
+        self.Ku = None
+        self.Pu = None
+
+    def step(self, process, t):
+
+        # process: measured value; t: time in seconds. Returns the relay
+        # output, and sets done once Ku and Pu are known.
+
+        ch = self.channel
+        if self.start is None:
+            self.start = t
+            self.high = True # start on the high side to kick the cycle
+            if self.setpoint is None:
+                self.setpoint = process
+        if self.done:
+            return self.output
+        if t - self.start > self.max_time:
+            self.done = self.failed = True
+            self.output = ch.bias
+            return self.output
+
+        if ch.error is None:
+            e = self.setpoint - process
+        else:
+            e = ch.error(self.setpoint, process)
+
+        # Track the extreme of the error over the current half cycle: with
+        # the relay high the process first keeps falling, so the error
+        # peaks above 0, and the other way round
+
+        if self.extreme is None or \
+           (e > self.extreme if self.high else e < self.extreme):
+            self.extreme = e
+
+        if e > ch.hysteresis and self.high is not True:
+            self.peaks.append(abs(self.extreme))
+            self.high = True
+            self.extreme = e
+            self.rises.append(t)
+        elif e < -ch.hysteresis and self.high is not False:
+            self.peaks.append(abs(self.extreme))
+            self.high = False
+            self.extreme = e
+        self.output = ch.bias + (ch.amplitude if self.high else
+                                 -ch.amplitude)
+
+        if len(self.rises) > self.skip + self.cycles:
+            self._identify()
+        return self.output
+
+    def _identify(self):
+        ch = self.channel
+        rises = self.rises[self.skip:]
+        self.Pu = (rises[-1] - rises[0]) / (len(rises) - 1)
+        peaks = self.peaks[2 * self.skip:]
+        a = sum(peaks) / len(peaks)
+        a = math.sqrt(max(a * a - ch.hysteresis ** 2, 1e-12))
+        self.Ku = 4 * ch.amplitude / (math.pi * a)
+        self.output = ch.bias
+        self.done = True
+
+    def law(self, i, c, f=None):
+
+        # Control law driving the channel's controls with the relay, for
+        # phases.Phase or scheduler.control_loop
+
+        u = self.step(getattr(i, self.channel.field), i.time)
+        for name in self.channel.controls:
+            setattr(c, name, u)
+
+    def gains(self, rule='pid'):
+
+        # Returns (Kp, Ki, Kd) from Ku and Pu with one of RULES
+
+        kp, ti, td = RULES[rule]
+        Kp = kp * self.Ku
+        Ki = Kp / (ti * self.Pu) if ti else 0.0
+        Kd = Kp * td * self.Pu
+        return Kp, Ki, Kd
+
+
+def write_gains(path, tuners, rule='pid'):
+
+    # Writes {channel: {Ku, Pu, Kp, Ki, Kd}} of the finished tuners as JSON
+
+    result = {}
+    for tuner in tuners:
+        if tuner.done and not tuner.failed:
+            Kp, Ki, Kd = tuner.gains(rule)
+            result[tuner.channel.name] = dict(Ku=tuner.Ku, Pu=tuner.Pu,
+                                              Kp=Kp, Ki=Ki, Kd=Kd, rule=rule)
+    with open(path, 'w') as out:
+        json.dump(result, out, indent=2, sort_keys=True)
+    return result
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    # A first-order plant with dead time, K e^(-Ls) / (tau s + 1), stepped
+    # at 50 Hz. Its ultimate point solves atan(w tau) + w L = pi.
+
+    K, tau, L, dt = 20.0, 1.0, 0.2, 0.02
+
+    def simulate(tuner):
+        delay = [0.0] * int(round(L / dt))
+        y = 0.0
+        t = 0.0
+        while not tuner.done:
+            u = tuner.step(y, t)
+            delay.append(u)
+            y += dt / tau * (K * delay.pop(0) - y)
+            t += dt
+        return t
+
+    lo, hi = 0.0, 100.0
+    for x in range(100):
+        w = (lo + hi) / 2
+        if math.atan(w * tau) + w * L < math.pi:
+            lo = w
+        else:
+            hi = w
+    Pu = 2 * math.pi / w
+    Ku = math.sqrt(1 + (w * tau) ** 2) / K
+
+    tuner = RelayTuner(Channel('test', 'roll', ('ailrn',), 0.0, 0.2, 0.05))
+    elapsed = simulate(tuner)
+    print('Ku {0:.4f} (exact {1:.4f}), Pu {2:.3f} s (exact {3:.3f} s), '
+          'found in {4:.1f} s of flight'.format(tuner.Ku, Ku, tuner.Pu, Pu,
+                                                elapsed))
+    assert not tuner.failed
+    # The relay sees the first harmonic only (describing function), which
+    # underestimates Ku by up to a few tens of percent on short dead times
+    assert abs(tuner.Pu / Pu - 1) < 0.15 and abs(tuner.Ku / Ku - 1) < 0.3
+    Kp, Ki, Kd = tuner.gains('pid')
+    assert abs(Kp - 0.6 * tuner.Ku) < 1e-12
+
+    path = os.path.join(tempfile.mkdtemp(), 'gains.json')
+    assert 'test' in write_gains(path, [tuner])
+    os.remove(path)
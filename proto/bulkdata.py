@@ -0,0 +1,212 @@
+# File: bulkdata.py
+
+# NumPy decoder for DATA@ payloads.
+#
+# The payload after the 5-byte label is viewed as a structured array of
+# 'I8f' groups with one np.frombuffer call, and all groups are scattered
+# into instrument columns in one step. The same code decodes one live
+# packet or a whole recorded flight log.
+
+import numpy as np
+
+from datagroups import instrument_groups
+from xplane import DATA_LABEL, LABEL_SIZE, GROUP_SIZE
+
+
+GROUP_DTYPE = np.dtype([('id', '<u4'), ('v', '<f4', (8,))])
+
+# Instrument columns filled by each X-Plane group, None for unused values
+
+GROUP_COLUMNS = dict(
+    (id, tuple(v[0] if isinstance(v, tuple) else None for v in group.values))
+    for id, group in instrument_groups.items())
+
+COLUMNS = tuple(name for group in sorted(GROUP_COLUMNS)
+                for name in GROUP_COLUMNS[group] if name is not None)
+
+COLUMN_INDEX = dict((name, i) for i, name in enumerate(COLUMNS))
+
+MAX_GROUP_ID = 256
+
+
+def _column_table():
+
+    # Returns a (MAX_GROUP_ID+1, 8) table giving the column of each group
+    # value, -1 where the value is not used. The last row catches every id
+    # beyond MAX_GROUP_ID.
+
+    table = np.full((MAX_GROUP_ID + 1, 8), -1, dtype=np.intp)
+    for group, names in GROUP_COLUMNS.items():
+        for k, name in enumerate(names):
+            if name is not None:
+                table[group, k] = COLUMN_INDEX[name]
+    return table
+
+COLUMN_TABLE = _column_table()
+
+
+def groups(msg):
+
+    # Returns the groups of one DATA@ datagram as a structured array view
+    # (no copy), or an empty array for any other message
+
+    # msg: bytes, bytearray or memoryview holding the datagram
+
+    if bytes(msg[:LABEL_SIZE]) != DATA_LABEL:
+        return np.empty(0, dtype=GROUP_DTYPE)
+    count = (len(msg) - LABEL_SIZE) // GROUP_SIZE
+    return np.frombuffer(msg, dtype=GROUP_DTYPE, count=count,
+                         offset=LABEL_SIZE)
+
+
+def scatter(ids, values, out):
+
+    # Scatters group values into instrument columns
+
+    # ids: group ids, shape (..., G)
+    # values: group values, shape (..., G, 8)
+    # out: float array of shape (..., len(COLUMNS)) updated in place
+
+    cols = COLUMN_TABLE[np.minimum(ids, MAX_GROUP_ID)]
+    used = cols >= 0
+    if out.ndim == 1:
+        out[cols[used]] = values[used]
+    else:
+        rows = np.broadcast_to(
+            np.arange(out.shape[0]).reshape((-1,) + (1,) * (cols.ndim - 1)),
+            cols.shape)
+        out[rows[used], cols[used]] = values[used]
+    return out
+
+
+def decode_into(msg, row):
+
+    # Decodes one live datagram into row, a float array of len(COLUMNS).
+    # Columns of groups missing from the packet keep their value.
+
+    g = groups(msg)
+    return scatter(g['id'], g['v'], row)
+
+
+def decode_packet(msg):
+
+    # Decodes one datagram into a new row, NaN for columns not received
+
+    row = np.full(len(COLUMNS), np.nan)
+    return decode_into(msg, row)
+
+
+def packets(data, packet_size):
+
+    # Views a recorded log of fixed-size DATA@ datagrams as a structured
+    # array with one record per packet (no copy)
+
+    # data: bytes-like object or np.memmap of the concatenated datagrams
+    # packet_size: size in bytes of every datagram
+
+    count = (packet_size - LABEL_SIZE) // GROUP_SIZE
+    dtype = np.dtype([('label', 'S5'), ('groups', GROUP_DTYPE, (count,))])
+    if dtype.itemsize != packet_size:
+        raise ValueError('packet size {0} is not a DATA@ datagram size'
+                         .format(packet_size))
+    return np.frombuffer(data, dtype=dtype,
+                         count=len(data) // packet_size)
+
+
+def _runs(cols):
+
+    # Yields (slot, first, last, column) for every run of group values
+    # that land in consecutive columns
+
+    for slot in range(cols.shape[0]):
+        k = 0
+        while k < 8:
+            if cols[slot, k] < 0:
+                k += 1
+                continue
+            first = k
+            while k + 1 < 8 and cols[slot, k + 1] == cols[slot, k] + 1:
+                k += 1
+            k += 1
+            yield slot, first, k, cols[slot, first]
+
+
+def decode_packets(data, packet_size):
+
+    # Decodes a recorded log in one call. Returns an (N, len(COLUMNS))
+    # float array, NaN for columns a packet did not carry. Packets whose
+    # label is not DATA@ give a row of NaN.
+
+    recs = packets(data, packet_size)
+    ids = recs['groups']['id']
+    values = recs['groups']['v']
+    valid = recs['label'] == DATA_LABEL
+
+    if len(recs) and valid.all() and (ids == ids[0]).all():
+
+        # Every packet carries the same groups in the same order (what
+        # X-Plane sends): one block copy per run of consecutive columns.
+
+        out = np.empty((len(recs), len(COLUMNS)))
+        filled = np.zeros(len(COLUMNS), dtype=bool)
+        cols = COLUMN_TABLE[np.minimum(ids[0], MAX_GROUP_ID)]
+        for slot, first, last, col in _runs(cols):
+            out[:, col:col + last - first] = values[:, slot, first:last]
+            filled[col:col + last - first] = True
+        out[:, ~filled] = np.nan
+        return out
+
+    out = np.full((len(recs), len(COLUMNS)), np.nan)
+    ids = np.where(valid[:, None], ids, MAX_GROUP_ID)
+    return scatter(ids, values, out)
+
+
+def load_log(path, packet_size):
+
+    # Memory-maps a recorded log file and decodes it
+
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    return decode_packets(data, packet_size)
+
+
+def columns(table, *names):
+
+    # Returns the named columns of a decoded table
+
+    return [table[..., COLUMN_INDEX[name]] for name in names]
+
+
+if __name__ == '__main__':
+    import time
+    from xplane import Receiver, sample_packet
+    import socket
+
+    # Compare with the scalar receive path on one packet
+
+    packet = sample_packet(4)
+    r = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    instr = r.feed(packet)
+    row = decode_packet(packet)
+    for name in COLUMNS:
+        value = row[COLUMN_INDEX[name]]
+        assert np.isnan(value) or value == getattr(instr, name), name
+
+    # Decode one million recorded packets
+
+    n = 1000000
+    log = bytearray(packet * n)
+    start = time.perf_counter()
+    table = decode_packets(log, len(packet))
+    elapsed = time.perf_counter() - start
+    assert np.array_equal(table[-1], row, equal_nan=True)
+    print('{0} packets in {1:.3f} s: {2:.1f} Mpackets/s, {3:.2f} GB/s'
+          .format(n, elapsed, n / elapsed / 1e6, len(log) / elapsed / 1e9))
+
+    # Mixed layouts take the general scatter path
+
+    mixed = bytearray(log[:len(packet) * 1000])
+    mixed[len(packet) + LABEL_SIZE:len(packet) + LABEL_SIZE + 4] = \
+        (99).to_bytes(4, 'little')
+    table = decode_packets(mixed, len(packet))
+    assert np.isnan(table[1, COLUMN_INDEX['kias']])
+    assert table[0, COLUMN_INDEX['kias']] == row[COLUMN_INDEX['kias']]
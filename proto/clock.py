@@ -0,0 +1,168 @@
+# File: clock.py
+
+# Clocks for the autopilot and its tools.
+#
+# Every script used to carry its own platform_time(), calling time.clock
+# (gone since Python 3.8) or the non-monotonic time.time. All time now
+# comes from one module-level clock that a replay can replace:
+#
+#   WallClock     monotonic host time, from perf_counter_ns when available
+#   SimClock      X-Plane sim time, derived from the packets received
+#   VirtualClock  time advanced by the program itself: sleeping advances
+#                 it at once, or after a wait scaled by a speed factor, so
+#                 recorded flights replay at many times real-time speed
+#
+# platform_time() returns the time of the current clock in seconds and
+# sleep() waits on it. Instruments.time, PID.run (through time_delta) and
+# the dashboard's timespan() all use them.
+#
+# Works with Python 2 and 3.
+
+import sys
+import time
+
+
+def _wall_time():
+
+    # Returns the best monotonic time function of this Python, in seconds
+
+    if hasattr(time, 'perf_counter_ns'):
+        ns = time.perf_counter_ns
+        return lambda: ns() * 1e-9
+    if hasattr(time, 'perf_counter'):
+        return time.perf_counter
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if sys.platform == 'win32' or sys.platform == 'cygwin':
+        return time.clock
+    return time.time
+
+
+# Host time
+
+class WallClock:
+
+    def __init__(self):
+        self.now = _wall_time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+# Sim time: totl_time of the newest Instruments, so group 1 (times) must be
+# among the data X-Plane sends
+
+class SimClock:
+
+    def __init__(self, receiver=None):
+
+        # receiver: xplane.Receiver whose front Instruments give the time;
+        #           without one the time only moves through update()
+
+        self.receiver = receiver
+        self.time = 0.0
+
+    def update(self, t):
+        self.time = t
+
+    def now(self):
+        if self.receiver is not None:
+            return self.receiver.front.totl_time
+        return self.time
+
+    def sleep(self, seconds):
+
+        # X-Plane keeps its own pace; sleep on the host clock
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+# Time that moves only when the program says so
+
+class VirtualClock:
+
+    def __init__(self, start=0.0, speed=None):
+
+        # start: initial time in seconds
+        # speed: None to never wait, or a multiple of real time to pace
+        #        sleep() at (2 waits half of every sleep, and so on)
+
+        self.time = start
+        self.speed = speed
+
+    def now(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+        return self.time
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        self.time += seconds
+
+
+_clock = WallClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+
+    # Makes clock the time source of platform_time() and sleep(); returns
+    # the previous one so it can be restored
+
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+
+def platform_time():
+    return _clock.now()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+if __name__ == '__main__':
+
+    wall = WallClock()
+    t0 = wall.now()
+    wall.sleep(0.01)
+    assert 0.009 < wall.now() - t0 < 0.5
+
+    # A replay on a virtual clock: 1000 packets 20 ms apart go through the
+    # receive path as fast as they decode, each with the right time_delta.
+    # This file runs as __main__, so go through the clock module xplane
+    # imports.
+
+    import socket
+    import clock
+    from xplane import Receiver, sample_packet
+
+    virtual = clock.VirtualClock()
+    previous = clock.set_clock(virtual)
+    r = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    start = time.time()
+    for step in range(1000):
+        clock.sleep(0.02)
+        i = r.feed(sample_packet(step))
+        assert step == 0 or abs(i.time_delta - 0.02) < 1e-9, i.time_delta
+    elapsed = time.time() - start
+    clock.set_clock(previous)
+    assert abs(virtual.now() - 20.0) < 1e-9
+    print('replayed 20 s of flight in {0:.3f} s ({1:.0f}x real time)'
+          .format(elapsed, 20.0 / elapsed))
+
+    sim = SimClock(r)
+    r.feed(sample_packet(3, times=True))
+    assert abs(sim.now() - 100.15) < 1e-4
@@ -0,0 +1,309 @@
+# File: datagroups.py
+
+# Registry of X-Plane DATA groups.
+#
+# Each received group maps its 8 values to Instruments fields (with their
+# units), each sent group maps its 8 values to Controls fields or to
+# constants. The registry is compiled once into one setter per received
+# group and one packer for the whole control datagram, so supporting a new
+# group means adding one entry below instead of another elif branch.
+
+import struct
+
+
+DATA_LABEL = b'DATA@'
+UNUSED     = -999     # X-Plane leaves a value untouched when sent -999
+
+
+# Describes one X-Plane DATA group
+
+class DataGroup:
+
+    def __init__(self, id, title, values):
+
+        # id: X-Plane data group id (row number in Data Input & Output)
+        # title: name shown by X-Plane
+        # values: 8 entries, each either (field, unit), a number sent as a
+        #         constant, or None for a value the autopilot ignores
+
+        if len(values) != 8:
+            raise ValueError('group {0} needs 8 values, got {1}'
+                             .format(id, len(values)))
+        self.id = id
+        self.title = title
+        self.values = tuple(values)
+
+    def fields(self):
+
+        # Returns (index, field, unit) for every value mapped to a field
+
+        return [(k, v[0], v[1]) for k, v in enumerate(self.values)
+                if isinstance(v, tuple)]
+
+
+instrument_groups = {}  # id -> DataGroup, groups received from X-Plane
+control_groups = []     # DataGroup, in the order they are sent
+
+
+def register_instruments(id, title, values):
+    group = DataGroup(id, title, values)
+    instrument_groups[id] = group
+    return group
+
+
+def register_controls(id, title, values):
+    group = DataGroup(id, title, values)
+    control_groups.append(group)
+    return group
+
+
+register_instruments(1, 'times', [
+    ('real_time', 's'), ('totl_time', 's'), ('missn_time', 's'),
+    ('timer_time', 's'), None, ('zulu_time', 'h'), ('local_time', 'h'),
+    ('hobbs_time', 'h')])
+
+register_instruments(3, 'speeds', [
+    ('kias', 'kt'), ('keas', 'kt'), ('ktas', 'kt'), ('ktgs', 'kt'),
+    None, ('mph', 'mph'), ('mphas', 'mph'), ('mphgs', 'mph')])
+
+register_instruments(13, 'trim/flap/slat/s-brakes', [
+    ('trim_elev', 'ratio'), ('trim_ailrn', 'ratio'), ('trim_ruddr', 'ratio'),
+    ('flap_handl', 'ratio'), ('flap_postn', 'ratio'), ('slat_ratio', 'ratio'),
+    ('sbrak_handl', 'ratio'), ('sbrak_postn', 'ratio')])
+
+register_instruments(17, 'pitch, roll, headings', [
+    ('pitch', 'deg'), ('roll', 'deg'), ('hding_true', 'deg'),
+    ('hding_mag', 'deg'), None, None, None, None])
+
+register_instruments(20, 'lat, lon, altitude', [
+    ('lat', 'deg'), ('lon', 'deg'), ('alt_msl', 'ft'), ('alt_agl', 'ft'),
+    ('on_rwy', 'bool'), ('alt_ind', 'ft'), None, None])
+
+register_controls(14, 'gear, brakes', [
+    ('gear', 'bool'), ('wbrak', 'ratio'), ('lbrak', 'ratio'),
+    ('rbrak', 'ratio'), 0, 0, 0, 0])
+
+register_controls(8, 'joystick ail/elv/rud', [
+    ('elev', 'ratio'), ('ailrn', 'ratio'), ('ruddr', 'ratio'), UNUSED,
+    ('nose', 'ratio'), UNUSED, UNUSED, UNUSED])
+
+register_controls(11, 'flight con ail/elv/rud', [
+    UNUSED, UNUSED, UNUSED, UNUSED, ('nose', 'ratio'), UNUSED, UNUSED,
+    UNUSED])
+
+register_controls(13, 'trim/flap/slat/s-brakes', [
+    ('trim_elev', 'ratio'), ('trim_ailrn', 'ratio'), ('trim_ruddr', 'ratio'),
+    ('flap', 'ratio'), UNUSED, UNUSED, ('sbrak', 'ratio'), UNUSED])
+
+register_controls(25, 'throttle command', [
+    ('thro1', 'ratio'), ('thro2', 'ratio'), ('thro3', 'ratio'),
+    ('thro4', 'ratio'), 0, 0, 0, 0])
+
+
+def _compile(source, name, namespace):
+    exec(source, namespace)
+    return namespace[name]
+
+
+values_struct = struct.Struct('<8f')
+
+
+def compile_setter(group, index=None):
+
+    # Returns setter(instr, buf, offset) unpacking the 8 group values found
+    # at offset in buf straight into the Instruments fields
+
+    # index: field -> position, for an instr that is a float array (the
+    #        values of xplane.Instruments) instead of an object
+
+    targets = []
+    for v in group.values:
+        if not isinstance(v, tuple):
+            targets.append('_')
+        elif index is None:
+            targets.append('instr.' + v[0])
+        else:
+            targets.append('instr[{0}]'.format(index[v[0]]))
+    source = ('def setter(instr, buf, offset):\n'
+              '    ({0},) = unpack_from(buf, offset)\n'.format(', '.join(targets)))
+    return _compile(source, 'setter',
+                    {'unpack_from': values_struct.unpack_from})
+
+
+def compile_setters(groups=None, index=None):
+
+    # Returns a dict group id -> setter for all registered instrument groups
+
+    if groups is None:
+        groups = instrument_groups
+    return dict((id, compile_setter(group, index))
+                for id, group in groups.items())
+
+
+def controls_struct(groups=None):
+    if groups is None:
+        groups = control_groups
+    return struct.Struct('<5s' + 'I8f' * len(groups))
+
+
+def compile_packer(groups=None):
+
+    # Returns pack(controls) building the whole control datagram and
+    # pack_into(buf, offset, controls), both laid out from the registry
+
+    if groups is None:
+        groups = control_groups
+    args = ['label']
+    for group in groups:
+        args.append(repr(group.id))
+        for v in group.values:
+            if isinstance(v, tuple):
+                args.append('c.' + v[0])
+            elif v is None:
+                args.append(repr(UNUSED))
+            else:
+                args.append(repr(v))
+    body = ', '.join(args)
+    namespace = {'st': controls_struct(groups), 'label': DATA_LABEL}
+    pack = _compile('def pack(c):\n    return st.pack({0})\n'.format(body),
+                    'pack', namespace)
+    pack_into = _compile('def pack_into(buf, offset, c):\n'
+                         '    st.pack_into(buf, offset, {0})\n'.format(body),
+                         'pack_into', namespace)
+    return pack, pack_into
+
+
+group_struct = struct.Struct('<I8f')
+
+
+def compile_incremental(groups=None, label_size=len(DATA_LABEL)):
+
+    # Returns two generated functions that encode into buf only the
+    # control groups whose Controls values differ from the tuples kept in
+    # last (one per group), or every group when everything is true:
+    #
+    #   update(buf, last, c, everything) keeps each group at its place in
+    #   the full datagram and returns the number of groups encoded
+    #
+    #   update_compact(buf, last, c, everything) packs the encoded groups
+    #   back to back after the label and returns the datagram size
+
+    if groups is None:
+        groups = control_groups
+
+    def group_code(g, group, offset):
+        names = ['c.' + v[0] for v in group.values if isinstance(v, tuple)]
+        args = [repr(group.id)]
+        for v in group.values:
+            if isinstance(v, tuple):
+                args.append('c.' + v[0])
+            elif v is None:
+                args.append(repr(UNUSED))
+            else:
+                args.append(repr(v))
+        return ['    v = ({0},)'.format(', '.join(names)),
+                '    if everything or v != last[{0}]:'.format(g),
+                '        pack_into(buf, {0}, {1})'.format(offset,
+                                                          ', '.join(args)),
+                '        last[{0}] = v'.format(g)]
+
+    full = ['def update(buf, last, c, everything=False):', '    n = 0']
+    compact = ['def update_compact(buf, last, c, everything=False):',
+               '    size = {0}'.format(label_size)]
+    for g, group in enumerate(groups):
+        full += group_code(g, group, label_size + g * group_struct.size)
+        full.append('        n += 1')
+        compact += group_code(g, group, 'size')
+        compact.append('        size += {0}'.format(group_struct.size))
+    full.append('    return n')
+    compact.append('    return size')
+
+    namespace = {'pack_into': group_struct.pack_into}
+    update = _compile('\n'.join(full) + '\n', 'update', namespace)
+    update_compact = _compile('\n'.join(compact) + '\n', 'update_compact',
+                              namespace)
+    return update, update_compact
+
+
+def instrument_fields():
+
+    # Returns all instrument fields in group order with their units
+
+    return [(field, unit) for id in sorted(instrument_groups)
+            for k, field, unit in instrument_groups[id].fields()]
+
+
+def control_fields():
+
+    # Returns all control fields in send order with their units, each once
+
+    fields = []
+    seen = set()
+    for group in control_groups:
+        for k, field, unit in group.fields():
+            if field not in seen:
+                seen.add(field)
+                fields.append((field, unit))
+    return fields
+
+
+if __name__ == '__main__':
+    import socket
+    import timeit
+    import xplane
+
+    # The if/elif chain of the autopilot scripts, as reference
+
+    msg_label_struct = struct.Struct('=5s')
+    data_packet_struct = struct.Struct('I8f')
+
+    def process_xplane_data(data, instr):
+        (id, v0, v1, v2, v3, v4, v5, v6, v7) = data
+        if id == 3:
+            instr.kias = v0; instr.keas = v1; instr.ktas = v2
+            instr.ktgs = v3; instr.mph = v5; instr.mphas = v6
+            instr.mphgs = v7
+        elif id == 13:
+            instr.trim_elev = v0; instr.trim_ailrn = v1
+            instr.trim_ruddr = v2; instr.flap_handl = v3
+            instr.flap_postn = v4; instr.slat_ratio = v5
+            instr.sbrak_handl = v6; instr.sbrak_postn = v7
+        elif id == 17:
+            instr.pitch = v0; instr.roll = v1; instr.hding_true = v2
+            instr.hding_mag = v3
+        elif id == 20:
+            instr.lat = v0; instr.lon = v1; instr.alt_msl = v2
+            instr.alt_agl = v3; instr.on_rwy = v4; instr.alt_ind = v5
+
+    def chain(msg, instr):
+        n = len(msg)
+        (label,) = msg_label_struct.unpack_from(msg, 0)
+        if label == b'DATA@':
+            i = msg_label_struct.size
+            while i < n:
+                data = data_packet_struct.unpack_from(msg, i)
+                process_xplane_data(data, instr)
+                i += data_packet_struct.size
+
+    known = xplane.sample_packet(1)
+    unknown = DATA_LABEL + struct.pack('<I8f', 0, *range(8)) * 4
+    r = xplane.Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    instr = xplane.Instruments()
+    assert r.feed(known).kias == 151
+
+    n = 100000
+    for name, msg in (('4 known groups', known), ('4 unknown groups', unknown)):
+        r.buf[:len(msg)] = msg
+        args = (instr, r.buf, r.ids, len(msg), r.setters)
+        n_chain = min(timeit.repeat(lambda: chain(msg, instr),
+                                    number=n, repeat=5))
+        n_table = min(timeit.repeat(lambda: xplane.decode_groups(*args),
+                                    number=n, repeat=5))
+        print('{0}: if/elif chain {1:.2f} us, registry {2:.2f} us per packet'
+              .format(name, n_chain / n * 1e6, n_table / n * 1e6))
+
+    c = xplane.Controls()
+    pack, pack_into = compile_packer()
+    print('control packet: {0} bytes, pack {1:.2f} us'.format(
+        len(pack(c)), min(timeit.repeat(lambda: pack(c), number=n,
+                                        repeat=3)) / n * 1e6))
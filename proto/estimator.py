@@ -0,0 +1,325 @@
+# File: estimator.py
+
+# Kalman filter state estimator.
+#
+# PID.run differentiates raw float32 packet values, and align_lon works
+# on longitude differences as small as 0.0001 degrees, near the float32
+# resolution of a longitude. KalmanEstimator filters the attitude,
+# altitude and position channels at packet rate and publishes smoothed
+# values and rates for the controllers to use instead of the raw
+# Instruments:
+#
+#     estimator = KalmanEstimator()
+#     i = estimator.filter(receiver.receive())  # smoothed Instruments
+#     roll_rate = estimator.rates.roll           # degrees per second
+#
+# Every channel is a constant-velocity model, x = (value, rate), driven by
+# an acceleration held constant over each sample (white, of spectral
+# density process, per field) and measured with noise (noise, per
+# field). The channels are independent, so the filter runs on NumPy
+# vectors across all channels at once with the 2x2 covariance held as
+# three vectors. At a steady packet rate the gain converges to a
+# constant, the alpha-beta gains of Kalata's tracking index, which have a
+# closed form: a tick is a predict and a correction, a handful of vector
+# operations, and the gains are recomputed in a few more when the average
+# dt drifts past tolerance, like DiscretePID's coefficients. Or the full
+# covariance is propagated with every actual dt (steady=False).
+
+import numpy as np
+
+from xplane import FIELD_INDEX, Instruments
+
+
+# Fields filtered: measurement noise (standard deviation, units of the
+# field) and process noise (acceleration spectral density, (units/s^2)^2
+# per Hz)
+
+ESTIMATED = {
+    'pitch':      (0.05, 10.0),
+    'roll':       (0.05, 20.0),
+    'hding_true': (0.05, 5.0),
+    'hding_mag':  (0.05, 5.0),
+    'alt_msl':    (0.5,  20.0),
+    'alt_agl':    (0.5,  20.0),
+    'alt_ind':    (0.5,  20.0),
+    'lat':        (5e-6, 1e-8),
+    'lon':        (5e-6, 1e-8),
+}
+
+HEADINGS = ('hding_true', 'hding_mag')
+
+
+class KalmanEstimator:
+
+    def __init__(self, fields=None, period=0.05, noise=None, process=None,
+                 steady=True, tolerance=0.2):
+
+        # fields: Instruments fields to filter, those of ESTIMATED by default
+        # period: nominal seconds between packets
+        # noise, process: {field: value} overriding ESTIMATED
+        # steady: constant gains for the average period (False propagates
+        #         the covariance with every dt)
+        # tolerance: relative drift of the average dt that triggers new
+        #            steady gains
+
+        if fields is None:
+            fields = sorted(ESTIMATED, key=FIELD_INDEX.get)
+        self.fields = tuple(fields)
+        self.index = np.array([FIELD_INDEX[f] for f in self.fields])
+        self.wraps = np.array([f in HEADINGS for f in self.fields])
+        self.any_wraps = bool(self.wraps.any())
+        noise = dict(noise or {})
+        process = dict(process or {})
+        self.R = np.array([noise.get(f, ESTIMATED[f][0]) ** 2
+                           for f in self.fields])
+        self.q = np.array([process.get(f, ESTIMATED[f][1])
+                           for f in self.fields])
+        self.steady = steady
+        self.tolerance = tolerance
+
+        # Published estimates: values and rates in Instruments slots, the
+        # rates of the unfiltered fields left at 0
+
+        self.state = Instruments()
+        self.rates = Instruments()
+        self.state_view = np.frombuffer(self.state.values)
+        self.rates_view = np.frombuffer(self.rates.values)
+
+        n = len(self.fields)
+        self.x = np.zeros(n)       # values
+        self.v = np.zeros(n)       # rates
+        self.r = np.zeros(n)       # innovation scratch
+        self.Paa = np.zeros(n)     # covariance (value, value)
+        self.Pav = np.zeros(n)     # covariance (value, rate)
+        self.Pvv = np.zeros(n)     # covariance (rate, rate)
+        self.views = {}            # id of values -> (values, NumPy view)
+        self.time = None
+        self.ticks = 0
+        self.retunes = 0
+        self.set_period(period)
+
+    def set_period(self, period):
+        self.period = period
+        self.dt_avg = period
+        self.k_x, self.k_v = self.steady_gains(period)
+
+    def steady_gains(self, dt):
+
+        # Returns the gain vectors of value and rate the Riccati recursion
+        # settles to for a fixed dt, in closed form: with the tracking
+        # index lam = sqrt(q dt^3 / R), r = (4 + lam - sqrt(8 lam +
+        # lam^2)) / 4, alpha = 1 - r^2 and beta = 2 (2 - alpha) -
+        # 4 sqrt(1 - alpha)
+
+        lam = np.sqrt(self.q * dt ** 3 / self.R)
+        r = (4 + lam - np.sqrt(8 * lam + lam * lam)) / 4
+        alpha = 1 - r * r
+        beta = 2 * (2 - alpha) - 4 * np.sqrt(1 - alpha)
+        return alpha, beta / dt
+
+    def _initial_covariance(self):
+        return self.R.copy(), np.zeros_like(self.R), self.R * 1e6
+
+    def _propagate(self, a, b, c, dt):
+        q = self.q
+        return (a + dt * (2 * b + dt * c) + q * dt ** 3 / 4,
+                b + dt * c + q * dt ** 2 / 2,
+                c + q * dt)
+
+    def reset(self):
+        self.time = None
+
+    def _view(self, instr):
+
+        # NumPy view of the values of instr, cached: a Receiver only ever
+        # hands out its two buffers
+
+        values = instr.values
+        entry = self.views.get(id(values))
+        if entry is None or entry[0] is not values:
+            if len(self.views) > 8:
+                self.views.clear()
+            entry = self.views[id(values)] = (values, np.frombuffer(values))
+        return entry[1]
+
+    def filter(self, instr):
+
+        # Takes in the packet in instr (once per Instruments.time) and
+        # returns the smoothed Instruments: instr with the filtered fields
+        # replaced by their estimates. Rates are in self.rates.
+
+        t = instr.time
+        z = self._view(instr)[self.index]
+        x, v, r = self.x, self.v, self.r
+        if self.time is None:
+            x[:] = z
+            v[:] = 0.0
+            self.Paa, self.Pav, self.Pvv = self._initial_covariance()
+        elif t != self.time:
+            dt = t - self.time
+            if dt <= 0:
+                dt = self.dt_avg
+
+            # Predict
+
+            x += v * dt
+            np.subtract(z, x, out=r)
+            if self.any_wraps:
+                w = self.wraps
+                r[w] = (r[w] + 180) % 360 - 180
+
+            # Correct
+
+            if self.steady:
+                avg = self.dt_avg + 0.05 * (dt - self.dt_avg)
+                self.dt_avg = avg
+                if abs(avg - self.period) > self.tolerance * self.period:
+                    self.retunes += 1
+                    self.set_period(avg)
+                x += self.k_x * r
+                v += self.k_v * r
+            else:
+                a, b, c = self._propagate(self.Paa, self.Pav, self.Pvv, dt)
+                s = a + self.R
+                kx = a / s
+                kv = b / s
+                x += kx * r
+                v += kv * r
+                self.Pvv = c - kv * b
+                self.Pav = (1 - kx) * b
+                self.Paa = (1 - kx) * a
+            if self.any_wraps:
+                w = self.wraps
+                x[w] %= 360
+        self.time = t
+        self.ticks += 1
+
+        self.state.values[:] = instr.values
+        self.state_view[self.index] = x
+        self.rates_view[self.index] = v
+        return self.state
+
+    def rate(self, field):
+        return self.rates.values[FIELD_INDEX[field]]
+
+
+if __name__ == '__main__':
+    import math
+    import time
+
+    # A roll oscillation and a climbing turn, sampled at 20 Hz as float32
+    # with noise; the filter against the raw finite difference PID.run
+    # takes today
+
+    period = 0.05
+    rng = np.random.default_rng(1)
+    estimator = KalmanEstimator(period=period)
+    raw = Instruments()
+    previous = None
+    err_fd = err_kf = err_val = err_raw = 0.0
+    err_lon = err_lon_raw = err_climb = 0.0
+    n = 2000
+    f32 = np.float32
+    for k in range(n):
+        t = k * period
+        roll = 20 * math.sin(0.4 * t)
+        roll_rate = 8 * math.cos(0.4 * t)
+        lon = -122.3 + 2e-5 * t
+        raw.time = t
+        raw.roll = float(f32(roll + rng.normal(0, 0.05)))
+        raw.pitch = float(f32(2 + rng.normal(0, 0.05)))
+        raw.hding_true = float(f32((355 + 2 * t) % 360))
+        raw.alt_msl = float(f32(1000 + 5 * t + rng.normal(0, 0.5)))
+        raw.lon = float(f32(lon))
+        raw.lat = float(f32(47.46))
+        state = estimator.filter(raw)
+        if k > 100:
+            fd = (raw.roll - previous) / period
+            err_fd += (fd - roll_rate) ** 2
+            err_kf += (estimator.rates.roll - roll_rate) ** 2
+            err_raw += (raw.roll - roll) ** 2
+            err_val += (state.roll - roll) ** 2
+            err_lon_raw += (raw.lon - lon) ** 2
+            err_lon += (state.lon - lon) ** 2
+            err_climb += (estimator.rate('alt_msl') - 5) ** 2
+            assert abs((state.hding_true - (355 + 2 * t)) % 360) < 0.05 or \
+                abs((state.hding_true - (355 + 2 * t)) % 360 - 360) < 0.05
+        previous = raw.roll
+    m = n - 101
+    rms = lambda s: math.sqrt(s / m)
+    print('roll rate rms error: finite difference {0:.3f}, filter {1:.3f} '
+          'deg/s'.format(rms(err_fd), rms(err_kf)))
+    print('roll rms error: raw {0:.4f}, filter {1:.4f} deg; lon raw '
+          '{2:.2e}, filter {3:.2e} deg; climb rate {4:.2f} ft/s'.format(
+              rms(err_raw), rms(err_val), rms(err_lon_raw), rms(err_lon),
+              rms(err_climb)))
+    assert rms(err_kf) < rms(err_fd) / 2
+    assert rms(err_val) < rms(err_raw)
+    assert rms(err_lon) < rms(err_lon_raw)
+    assert rms(err_climb) < 2.0
+    assert abs(estimator.rate('hding_true') - 2) < 0.1
+
+    # The full covariance filter converges to the steady gains (the
+    # corrected variance of a value is K R)
+
+    full = KalmanEstimator(period=period, steady=False)
+    for k in range(400):
+        raw.time = k * period
+        full.filter(raw)
+    assert np.allclose(full.Paa / full.R, estimator.k_x, rtol=1e-3)
+
+    # The closed form is where the Riccati recursion settles
+
+    for dt in (0.01, 0.05, 0.1):
+        a, b, c = full._initial_covariance()
+        for k in range(3000):
+            a, b, c = full._propagate(a, b, c, dt)
+            kx, kv = a / (a + full.R), b / (a + full.R)
+            a, b, c = (1 - kx) * a, (1 - kx) * b, c - kv * b
+        k_x, k_v = full.steady_gains(dt)
+        assert np.allclose(kx, k_x, rtol=1e-6) and \
+            np.allclose(kv, k_v, rtol=1e-6), dt
+
+    # The average dt drifting to 30 ms retunes the steady gains
+
+    for k in range(400):
+        raw.time += 0.03
+        estimator.filter(raw)
+    assert estimator.retunes >= 1 and abs(estimator.period - 0.03) < 0.01
+
+    # Per-tick cost against the 20 ms tick of a 50 Hz loop
+
+    budget = 0.02
+    for steady in (True, False):
+        e = KalmanEstimator(steady=steady)
+        ticks = 20000
+        start = time.perf_counter()
+        for k in range(ticks):
+            raw.time = k * period
+            e.filter(raw)
+        cost = (time.perf_counter() - start) / ticks
+        print('{0} gains, {1} channels: {2:.1f} us per tick ({3:.2%} of a '
+              '50 Hz tick)'.format('steady' if steady else 'full',
+                                   len(e.fields), cost * 1e6, cost / budget))
+        assert cost < budget / 20
+
+    # A retune happens inside a tick: its cost, and ticks with the packet
+    # period drifting back and forth so that it keeps retuning
+
+    e = KalmanEstimator()
+    n = 2000
+    start = time.perf_counter()
+    for k in range(n):
+        e.set_period(0.01 + k * 1e-5)
+    retune = (time.perf_counter() - start) / n
+    e = KalmanEstimator()
+    t = 0.0
+    start = time.perf_counter()
+    for k in range(ticks):
+        t += 0.05 if (k // 100) % 2 else 0.02
+        raw.time = t
+        e.filter(raw)
+    cost = (time.perf_counter() - start) / ticks
+    print('retune: {0:.1f} us; {1} retunes over {2} drifting ticks, {3:.1f} '
+          'us per tick'.format(retune * 1e6, e.retunes, ticks, cost * 1e6))
+    assert e.retunes >= 50 and retune < budget / 100 and cost < budget / 20
@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 import multiprocessing as mp
 import sys
 import time
+from clock import platform_time
 
 MAX_DATA_LEN = 60
 
@@ -171,10 +172,7 @@ class FlightInfo:
     Retourne la meilleure mesure du temps sur le système de l'utilisateur.
     """
     def platform_time(self):
-        if sys.platform == 'win32' or sys.platform == 'cygwin':
-            return time.clock()
-        else:
-            return time.time()
+        return platform_time()
 
     """
     Arrête le calcul de la courbe.
@@ -0,0 +1,201 @@
+# File: gains.py
+
+# Gain schedules.
+#
+# The gain factories of the scripts (steer_PID, roll_PID...) compute their
+# gains once, from the time_delta of the moment, and keep them from the
+# takeoff roll up to 5000 ft. A GainSchedule instead holds gains
+# precomputed on a grid over flight envelope axes (KIAS, altitude, flap
+# position...) and interpolates them every tick: multilinear over the 2^n
+# corners of the cell, the cell found in O(1) on evenly spaced axes and by
+# bisection otherwise, in a function generated for the schedule's axes.
+#
+#     schedule = GainSchedule.from_function(
+#         [Axis('kias', range(0, 301, 50)), Axis('alt_agl', [0, 500, 5000])],
+#         lambda kias, alt: (0.02 * 100 / max(kias, 60), 0.001, 0.005))
+#     schedule.apply(roll, instruments)  # roll: pid.DiscretePID
+
+from bisect import bisect_right
+import itertools
+
+
+# One axis of a schedule: an Instruments field and its breakpoints
+
+class Axis:
+
+    def __init__(self, field, breakpoints):
+
+        # field: Instruments attribute read at every lookup
+        # breakpoints: increasing values; inputs outside are clamped
+
+        points = [float(x) for x in breakpoints]
+        if len(points) < 2 or any(b <= a for a, b in zip(points, points[1:])):
+            raise ValueError('axis {0} needs at least 2 increasing '
+                             'breakpoints'.format(field))
+        self.field = field
+        self.points = points
+        self.first = points[0]
+        self.last = points[-1]
+        self.cells = len(points) - 1
+        step = (self.last - self.first) / self.cells
+        self.uniform = all(abs(p - (self.first + k * step)) <= 1e-9 * step
+                           for k, p in enumerate(points))
+        self.step = step
+
+    def locate(self, x):
+
+        # Returns (cell, fraction of the cell) for x
+
+        if x <= self.first:
+            return 0, 0.0
+        if x >= self.last:
+            return self.cells - 1, 1.0
+        if self.uniform:
+            t = (x - self.first) / self.step
+            k = int(t)
+            if k >= self.cells:
+                k = self.cells - 1
+            return k, t - k
+        points = self.points
+        k = bisect_right(points, x) - 1
+        return k, (x - points[k]) / (points[k + 1] - points[k])
+
+
+class GainSchedule:
+
+    def __init__(self, axes, table):
+
+        # axes: list of Axis
+        # table: nested sequences indexed like the axes, holding at every
+        #        grid point a tuple of gains, e.g. (Kp, Ki, Kd)
+
+        self.axes = axes
+        self.fields = [axis.field for axis in axes]
+        shape = [len(axis.points) for axis in axes]
+
+        # Flat table of the grid points, row-major with strides
+
+        self.values = []
+        for index in itertools.product(*[range(n) for n in shape]):
+            entry = table
+            for k in index:
+                entry = entry[k]
+            self.values.append(tuple(float(g) for g in entry))
+        self.gains = len(self.values[0])
+        strides = []
+        stride = 1
+        for n in reversed(shape):
+            strides.insert(0, stride)
+            stride *= n
+        self.strides = strides
+
+        # at(*coords) returns the interpolated gains at the given axis
+        # values, lookup(instr) those at the flight condition of instr
+
+        self.at = self._compile()
+        self.lookup = self._compile_lookup()
+
+    def _compile(self):
+
+        # Generates at(*coords): the weights of the 2^n cell corners and,
+        # for every gain, one sum of products over a flat list
+
+        n = len(self.axes)
+        args = ', '.join('x{0}'.format(a) for a in range(n))
+        lines = ['def at({0}):'.format(args)]
+        for a in range(n):
+            lines.append('    k{0}, f{0} = locate{0}(x{0})'.format(a))
+            lines.append('    g{0} = 1.0 - f{0}'.format(a))
+        lines.append('    b = ' + ' + '.join('k{0} * {1}'.format(a, stride)
+                                            for a, stride in
+                                            enumerate(self.strides)))
+        corners = []
+        for bits in itertools.product((0, 1), repeat=n):
+            offset = sum(s for s, bit in zip(self.strides, bits) if bit)
+            weight = ' * '.join(('f{0}' if bit else 'g{0}').format(a)
+                                for a, bit in enumerate(bits))
+            lines.append('    w{0} = {1}'.format(len(corners), weight))
+            corners.append(offset)
+        sums = []
+        for g in range(self.gains):
+            sums.append(' + '.join('w{0} * v{1}[b + {2}]'.format(c, g, offset)
+                                   for c, offset in enumerate(corners)))
+        lines.append('    return ({0},)'.format(', '.join(sums)))
+
+        namespace = {}
+        for a, axis in enumerate(self.axes):
+            namespace['locate{0}'.format(a)] = axis.locate
+        for g in range(self.gains):
+            namespace['v{0}'.format(g)] = [v[g] for v in self.values]
+        exec('\n'.join(lines) + '\n', namespace)
+        return namespace['at']
+
+    def _compile_lookup(self):
+        source = 'def lookup(instr):\n    return at({0})\n'.format(
+            ', '.join('instr.' + field for field in self.fields))
+        namespace = {'at': self.at}
+        exec(source, namespace)
+        return namespace['lookup']
+
+    @classmethod
+    def from_function(cls, axes, fn):
+
+        # Builds the table from fn(*axis values) -> gains at each grid point
+
+        def build(depth, args):
+            if depth == len(axes):
+                return fn(*args)
+            return [build(depth + 1, args + [x]) for x in axes[depth].points]
+        return cls(axes, build(0, []))
+
+    def apply(self, pid, instr):
+
+        # Gives pid (pid.DiscretePID) the gains of the current flight
+        # condition; its velocity form makes the change bumpless
+
+        pid.set_gains(*self.lookup(instr))
+
+
+if __name__ == '__main__':
+    import time
+    from xplane import Instruments
+
+    # A roll schedule over KIAS (even), altitude (uneven) and flaps
+
+    def roll_gains(kias, alt, flap):
+        return (2.0 / max(kias, 60) + 0.001 * flap, 0.0002 * alt / 1000,
+                0.01 + 0.0001 * kias)
+
+    axes = [Axis('kias', range(0, 301, 25)),
+            Axis('alt_agl', [0, 100, 500, 1000, 2000, 5000]),
+            Axis('flap_postn', [0, 0.25, 0.5, 1.0])]
+    schedule = GainSchedule.from_function(axes, roll_gains)
+    assert axes[0].uniform and not axes[1].uniform
+
+    # Exact on grid points and on every linear part; clamped outside
+
+    kp, ki, kd = schedule.at(150, 1000, 0.25)
+    assert abs(kp - roll_gains(150, 1000, 0.25)[0]) < 1e-12
+    kp, ki, kd = schedule.at(137.5, 1500, 0.375)
+    assert abs(ki - roll_gains(0, 1500, 0)[1]) < 1e-12
+    assert abs(kd - roll_gains(137.5, 0, 0)[2]) < 1e-12
+    assert schedule.at(400, -10, 2)[1] == 0.0
+
+    from pid import DiscretePID
+    instr = Instruments()
+    instr.kias, instr.alt_agl, instr.flap_postn = 160, 750, 0.3
+    roll = DiscretePID(0, 0, 0)
+    schedule.apply(roll, instr)
+    assert abs(roll.Kd - 0.026) < 1e-12
+
+    n = 100000
+    start = time.perf_counter()
+    for x in range(n):
+        schedule.lookup(instr)
+    lookup = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for x in range(n):
+        schedule.apply(roll, instr)
+    apply = (time.perf_counter() - start) / n
+    print('3-axis schedule: lookup {0:.2f} us, lookup and set_gains {1:.2f} us'
+          .format(lookup * 1e6, apply * 1e6))
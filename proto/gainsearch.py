@@ -0,0 +1,381 @@
+# File: gainsearch.py
+
+# Parallel gain search over headless simulated flights.
+#
+# Instead of flying X-Plane one session at a time and editing
+# PID(0.00004, 0.000003, Kd*8) by hand, candidate gains are flown against
+# StandIn, a small local model of one aircraft axis that fills Instruments
+# from Controls at the packet rate, so the control laws are the same
+# (i, c) functions as in the autopilot. Each flight is scored from the
+# overshoot, the settling time and the control effort of a step response;
+# a pool of worker processes flies the candidates of a grid or random
+# search, and a ResultCache file keeps the scores so a rerun only flies
+# the configurations it has not seen.
+#
+#     cache = ResultCache('gains-roll.jsonl')
+#     best = search(TASKS['roll'], random_gains(BOUNDS['roll'], 200), cache)
+#     print(best[0])  # (cost, (Kp, Ki, Kd), metrics)
+
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import time
+
+from pid import DiscretePID
+from xplane import Controls, Instruments
+
+
+# A stand-in for X-Plane: one axis, control -> rate through a first order
+# lag, rate -> angle, with the packet delay of the real loop
+
+class StandIn:
+
+    def __init__(self, field, control, gain, tau, delay=1, period=0.05,
+                 rate_field=None):
+
+        # field: Instruments field of the angle (roll, hding_true...)
+        # control: Controls field driving it (ailrn, ruddr...)
+        # gain: steady rate in degrees per second at full control
+        # tau: time constant of the rate, seconds
+        # delay: packets between a command and its first effect
+        # period: seconds between packets
+        # rate_field: Instruments field for the rate, if any
+
+        self.field = field
+        self.control = control
+        self.gain = gain
+        self.tau = tau
+        self.delay = delay
+        self.period = period
+        self.rate_field = rate_field
+        self.instruments = Instruments()
+        self.controls = Controls()
+        self.reset()
+
+    def reset(self, angle=0.0):
+        self.angle = angle
+        self.rate = 0.0
+        self.commands = [0.0] * self.delay
+        self.time = 0.0
+        instr = self.instruments
+        instr.time = 0.0
+        instr.time_delta = self.period
+        setattr(instr, self.field, angle)
+        self.controls.__init__()
+
+    def step(self):
+
+        # Applies the current controls for one packet period and returns
+        # the new instruments
+
+        self.commands.append(getattr(self.controls, self.control))
+        u = self.commands.pop(0)
+        T = self.period
+        self.rate += T / self.tau * (self.gain * u - self.rate)
+        self.angle += T * self.rate
+        self.time += T
+        instr = self.instruments
+        instr.time = self.time
+        setattr(instr, self.field, self.angle)
+        if self.rate_field is not None:
+            setattr(instr, self.rate_field, self.rate)
+        return instr
+
+
+# One scored flight: a step of the setpoint flown for a given duration
+
+class Task:
+
+    def __init__(self, name, plant, setpoint, duration=20.0, band=0.05,
+                 weights=None):
+
+        # plant: dict of StandIn arguments (picklable for the workers)
+        # setpoint: step size, from 0, in units of the field
+        # band: settled once within band * setpoint of the setpoint
+        # weights: cost weights, COST_WEIGHTS by default
+
+        self.name = name
+        self.plant = plant
+        self.setpoint = setpoint
+        self.duration = duration
+        self.band = band
+        self.weights = weights if weights is not None else COST_WEIGHTS
+
+    def digest(self):
+
+        # Short hash of everything a score depends on, so cached scores of
+        # an older definition of the task are not reused
+
+        definition = json.dumps([self.name, self.plant, self.setpoint,
+                                 self.duration, self.band, self.weights],
+                                sort_keys=True)
+        return hashlib.sha1(definition.encode()).hexdigest()[:12]
+
+
+# cost = overshoot (fraction of the step) + settling (fraction of the
+# flight) + effort (total control travel per second)
+
+COST_WEIGHTS = {'overshoot': 2.0, 'settling': 1.0, 'effort': 0.5}
+
+TASKS = {
+    'roll':  Task('roll', dict(field='roll', control='ailrn', gain=60.0,
+                               tau=0.4), 30.0),
+    'steer': Task('steer', dict(field='hding_true', control='ruddr',
+                                gain=20.0, tau=0.8, delay=2), 10.0, 30.0),
+}
+
+# Search ranges (low, high) of Kp, Ki, Kd for random_gains and grid_gains
+
+BOUNDS = {
+    'roll':  ((0.002, 0.2), (0.0001, 0.05), (0.0001, 0.05)),
+    'steer': ((0.005, 0.5), (0.0001, 0.05), (0.0001, 0.2)),
+}
+
+
+def fly(task, gains):
+
+    # Flies one candidate; returns the metrics dict
+
+    Kp, Ki, Kd = gains
+    plant = StandIn(**task.plant)
+    pid = DiscretePID(Kp, Ki, Kd, period=plant.period)
+    field, control = plant.field, plant.control
+    setpoint = task.setpoint
+    band = abs(task.band * setpoint)
+    instr = plant.instruments
+    controls = plant.controls
+
+    peak = 0.0
+    settled = 0.0
+    effort = 0.0
+    u_prev = 0.0
+    steps = int(round(task.duration / plant.period))
+    pid.run(getattr(instr, field), 0.0) # settled at 0 before the step
+    for k in range(steps):
+        y = getattr(instr, field)
+        u = pid.run(y, setpoint)
+        setattr(controls, control, u)
+        effort += abs(u - u_prev)
+        u_prev = u
+        plant.step()
+        e = (getattr(instr, field) - setpoint) * (1 if setpoint > 0 else -1)
+        if e > peak:
+            peak = e
+        if abs(e) > band:
+            settled = plant.time
+    if not math.isfinite(plant.angle):
+        return dict(overshoot=float('inf'), settling=task.duration,
+                    effort=effort)
+    return dict(overshoot=peak / abs(setpoint), settling=settled,
+                effort=effort / task.duration)
+
+
+def cost(task, metrics):
+    w = task.weights
+    return w['overshoot'] * metrics['overshoot'] + \
+           w['settling'] * metrics['settling'] / task.duration + \
+           w['effort'] * metrics['effort']
+
+
+def _evaluate(args):
+    task, gains = args
+    metrics = fly(task, gains)
+    return gains, cost(task, metrics), metrics
+
+
+# Candidate generators
+
+def grid_gains(bounds, points=5):
+
+    # Every combination of points log-spaced values per gain
+
+    axes = []
+    for low, high in bounds:
+        ratio = (high / low) ** (1.0 / (points - 1))
+        axes.append([low * ratio ** k for k in range(points)])
+    return list(itertools.product(*axes))
+
+
+def random_gains(bounds, n, seed=0):
+
+    # n candidates drawn log-uniformly within bounds
+
+    rng = random.Random(seed)
+    return [tuple(math.exp(rng.uniform(math.log(low), math.log(high)))
+                  for low, high in bounds) for k in range(n)]
+
+
+def refine(best, n, spread=0.5, seed=0):
+
+    # n candidates scattered log-normally around the given gains, for a
+    # second, narrower pass
+
+    rng = random.Random(seed)
+    return [tuple(g * math.exp(rng.gauss(0, spread)) for g in best)
+            for k in range(n)]
+
+
+# Scores of the flights already flown, one JSON line per flight, keyed by
+# task name, task definition hash and gains
+
+class ResultCache:
+
+    def __init__(self, path=None):
+
+        # path: file the results are appended to; None keeps them in memory
+
+        self.path = path
+        self.results = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    key = (entry['task'], entry.get('task_hash'),
+                           tuple(entry['gains']))
+                    self.results[key] = (entry['cost'], entry['metrics'])
+
+    @staticmethod
+    def key(task, gains):
+        return task.name, task.digest(), tuple(float('{0:.6g}'.format(g))
+                                               for g in gains)
+
+    def get(self, task, gains):
+        return self.results.get(self.key(task, gains))
+
+    def add(self, task, gains, score, metrics):
+        key = self.key(task, gains)
+        self.results[key] = (score, metrics)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'task': key[0], 'task_hash': key[1],
+                                    'gains': list(key[2]), 'cost': score,
+                                    'metrics': metrics}) + '\n')
+
+
+class SearchStats:
+
+    def __init__(self):
+        self.flown = 0
+        self.cached = 0
+        self.seconds = 0.0
+        self.workers = 1
+
+    def rate(self):
+
+        # Scored flights per minute per core
+
+        if not self.seconds:
+            return 0.0
+        return self.flown / self.seconds * 60 / self.workers
+
+    def report(self):
+        return '{0} flights ({1} cached) in {2:.2f} s on {3} workers: ' \
+               '{4:.0f} flights/min/core'.format(self.flown, self.cached,
+                                                 self.seconds, self.workers,
+                                                 self.rate())
+
+
+def search(task, candidates, cache=None, workers=None, stats=None):
+
+    # Flies the candidates not in cache on workers processes (all cores
+    # by default, 1 flies in this process) and returns every candidate as
+    # (cost, gains, metrics), best first
+
+    cache = cache if cache is not None else ResultCache()
+    stats = stats if stats is not None else SearchStats()
+    workers = workers or os.cpu_count() or 1
+    todo = []
+    seen = set()
+    for gains in candidates:
+        key = cache.key(task, gains)
+        if cache.get(task, gains) is not None or key in seen:
+            stats.cached += 1
+        else:
+            seen.add(key)
+            todo.append((task, key[2]))
+
+    start = time.perf_counter()
+    if workers == 1 or len(todo) < 2:
+        results = map(_evaluate, todo)
+        pool = None
+    else:
+        pool = mp.Pool(workers)
+        chunk = max(1, len(todo) // (workers * 8))
+        results = pool.imap_unordered(_evaluate, todo, chunk)
+    try:
+        for gains, score, metrics in results:
+            cache.add(task, gains, score, metrics)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    stats.seconds += time.perf_counter() - start
+    stats.flown += len(todo)
+    stats.workers = workers
+
+    scored = []
+    for gains in candidates:
+        score, metrics = cache.get(task, gains)
+        scored.append((score, cache.key(task, gains)[2], metrics))
+    scored.sort(key=lambda entry: entry[0])
+    return scored
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    task = TASKS['roll']
+
+    # A plausible controller settles; P alone with a tiny gain never gets
+    # there, and a huge gain chatters on the limits
+
+    good = fly(task, (0.02, 0.002, 0.002))
+    assert good['settling'] < task.duration / 2, good
+    slow = fly(task, (0.0005, 0, 0))
+    assert slow['settling'] >= task.duration - 1, slow
+    assert cost(task, fly(task, (5.0, 0, 0))) > cost(task, good)
+
+    # Random search then a refinement around the best, cached on disk
+
+    path = os.path.join(tempfile.mkdtemp(), 'gains.jsonl')
+    cache = ResultCache(path)
+    stats = SearchStats()
+    first = search(task, random_gains(BOUNDS['roll'], 400), cache,
+                   stats=stats)
+    best = search(task, refine(first[0][1], 200), cache, stats=stats)
+    print(stats.report())
+    print('best {0}: cost {1:.3f}, overshoot {2:.1%}, settling {3:.2f} s, '
+          'effort {4:.3f}/s'.format(
+              ', '.join('{0:.4g}'.format(g) for g in best[0][1]), best[0][0],
+              best[0][2]['overshoot'], best[0][2]['settling'],
+              best[0][2]['effort']))
+    assert best[0][0] <= first[0][0]
+
+    # A rerun from the file flies nothing
+
+    again = SearchStats()
+    rerun = search(task, random_gains(BOUNDS['roll'], 400),
+                   ResultCache(path), stats=again)
+    assert again.flown == 0 and again.cached == 400
+    assert rerun[0][1] == first[0][1]
+
+    # A changed task definition flies again instead of reusing old scores
+
+    changed = Task(task.name, task.plant, task.setpoint, task.duration,
+                   task.band, dict(COST_WEIGHTS, effort=5.0))
+    again = SearchStats()
+    search(changed, random_gains(BOUNDS['roll'], 20), ResultCache(path),
+           workers=1, stats=again)
+    assert again.flown == 20 and again.cached == 0
+
+    # One core, for the per-core rate without pool overhead
+
+    single = SearchStats()
+    search(task, grid_gains(BOUNDS['roll'], 4), ResultCache(), workers=1,
+           stats=single)
+    print('serial: ' + single.report())
+    os.remove(path)
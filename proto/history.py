@@ -0,0 +1,179 @@
+# File: history.py
+
+# Ring buffer holding the last seconds of every instrument channel.
+#
+# Rows are Instruments.values, columns the INSTRUMENT_FIELDS. Every row is
+# written twice, at k and k + size of a 2*size array, so the last n rows
+# are always one contiguous slice: append() is two row copies and every
+# window query works on a NumPy view, without copying, wrapped or not.
+# Queries are vectorized over the window and over the channels, cheap
+# enough to compute smoothed rates on every tick:
+#
+#     history.append(instr)
+#     climb = history.slope('alt_agl', 1.0)  # ft/s over the last second
+
+import numpy as np
+
+from xplane import INSTRUMENT_FIELDS, FIELD_INDEX
+
+
+TIME = FIELD_INDEX['time']
+
+
+class History:
+
+    def __init__(self, seconds=10.0, rate=50):
+
+        # seconds: time span to keep
+        # rate: highest expected sample rate in Hz, sizes the buffer
+
+        self.size = int(seconds * rate) + 1
+        self.data = np.zeros((2 * self.size, len(INSTRUMENT_FIELDS)))
+        self.next = 0   # row written by the next append
+        self.count = 0  # rows held, up to size
+
+    def __len__(self):
+        return self.count
+
+    def append(self, instr):
+
+        # instr: Instruments, or any sequence of len(INSTRUMENT_FIELDS)
+        #        floats in that order
+
+        values = getattr(instr, 'values', instr)
+        k = self.next
+        data = self.data
+        data[k] = values
+        data[k + self.size] = values
+        k += 1
+        self.next = 0 if k == self.size else k
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        self.next = 0
+        self.count = 0
+
+    def window(self, n=None):
+
+        # Returns a view of the last n rows (all rows when None), oldest
+        # first
+
+        if n is None or n > self.count:
+            n = self.count
+        end = self.next + self.size
+        return self.data[end - n:end]
+
+    def last(self, seconds):
+
+        # Returns a view of the rows of the last seconds, measured on the
+        # time column back from the newest row
+
+        rows = self.window()
+        if not len(rows):
+            return rows
+        times = rows[:, TIME]
+        first = np.searchsorted(times, times[-1] - seconds, side='left')
+        return rows[first:]
+
+    def column(self, name, seconds=None):
+
+        # Returns a view of one channel over the last seconds (everything
+        # held when None)
+
+        rows = self.window() if seconds is None else self.last(seconds)
+        return rows[:, FIELD_INDEX[name]]
+
+    def _select(self, name, seconds):
+
+        # Returns (times, values) views, values of one channel or, for
+        # name None, of all channels
+
+        rows = self.window() if seconds is None else self.last(seconds)
+        if name is None:
+            return rows[:, TIME], rows
+        return rows[:, TIME], rows[:, FIELD_INDEX[name]]
+
+    def mean(self, name=None, seconds=None):
+        return self._select(name, seconds)[1].mean(axis=0)
+
+    def min(self, name=None, seconds=None):
+        return self._select(name, seconds)[1].min(axis=0)
+
+    def max(self, name=None, seconds=None):
+        return self._select(name, seconds)[1].max(axis=0)
+
+    def slope(self, name=None, seconds=None):
+
+        # Least-squares slope of the channel(s) against time, in units per
+        # second; 0 with fewer than two samples
+
+        t, x = self._select(name, seconds)
+        if len(t) < 2:
+            return np.zeros(x.shape[1:]) if x.ndim > 1 else 0.0
+        tc = t - t.mean()
+        denom = tc.dot(tc)
+        if denom == 0:
+            return np.zeros(x.shape[1:]) if x.ndim > 1 else 0.0
+        return tc.dot(x - x.mean(axis=0)) / denom
+
+    def rate(self, name=None, seconds=None):
+
+        # Finite-difference rate between the oldest and the newest sample
+        # of the window, in units per second
+
+        t, x = self._select(name, seconds)
+        if len(t) < 2 or t[-1] == t[0]:
+            return np.zeros(x.shape[1:]) if x.ndim > 1 else 0.0
+        return (x[-1] - x[0]) / (t[-1] - t[0])
+
+
+if __name__ == '__main__':
+    import socket
+    import time
+    from xplane import TIME_SIM, Receiver, sample_packet
+
+    # 20 s of packets at 50 Hz, alt_agl climbing 1 ft per packet, through
+    # a 10 s history
+
+    r = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
+                 time_source=TIME_SIM)
+    history = History(seconds=10.0, rate=50)
+    for step in range(1000):
+        i = r.feed(sample_packet(step, times=True))
+        i.time = step * 0.02
+        history.append(i)
+
+    assert len(history) == history.size == 501
+    assert history.window(1)[0, TIME] == i.time
+    rows = history.last(1.0)
+    assert len(rows) == 51 and np.shares_memory(rows, history.data)
+    assert abs(history.slope('alt_agl', 1.0) - 50) < 1e-6
+    assert abs(history.rate('alt_agl', 2.0) - 50) < 1e-6
+    assert history.min('alt_agl', 1.0) == 567 + 949
+    assert history.max('alt_agl') == 567 + 999
+    slopes = history.slope(seconds=1.0)
+    assert abs(slopes[FIELD_INDEX['kias']] - 50) < 1e-6
+
+    # Cost per tick of an append and of smoothed rates
+
+    n = 20000
+    clock = time.perf_counter
+    elapsed = 0.0
+    for step in range(n):
+        i.time = 20.0 + step * 0.02
+        start = clock()
+        history.append(i)
+        elapsed += clock() - start
+    append = elapsed / n
+    start = clock()
+    for step in range(n):
+        history.slope('alt_agl', 0.5)
+    slope = (clock() - start) / n
+    start = clock()
+    for step in range(n):
+        history.slope(None, 0.5)
+    slopes = (clock() - start) / n
+    print('append {0:.2f} us, slope of one channel {1:.2f} us, of all {2} '
+          'channels {3:.2f} us'.format(append * 1e6, slope * 1e6,
+                                       len(INSTRUMENT_FIELDS), slopes * 1e6))
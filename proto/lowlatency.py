@@ -0,0 +1,229 @@
+# File: lowlatency.py
+
+# Low-latency mode: no garbage collector pauses inside critical phases.
+#
+# CPython's cyclic collector runs whenever enough container objects were
+# allocated, at whatever point of the tick that happens: with the scripts'
+# copy.copy of Instruments, deque per packet and print per tick, that can
+# be in the middle of the flare. The receive, control and send path of
+# xplane, phases and scheduler allocates nothing in steady state, so
+# GCGuard can freeze everything allocated during setup out of the
+# collector's reach (gc.freeze), switch automatic collection off and run
+# the collections itself at safe points: after the command of a tick is
+# sent, and never while a critical phase is flown.
+#
+#     guard = GCGuard()
+#     guard.start()
+#     flight = Flight(plan, guard=guard)  # Phase(..., critical=True)
+#     run(flight, receiver, sender)       # collects between ticks
+#
+# check_tick() is the tracemalloc regression check that the tick stays
+# allocation-free, with xplane.measure_allocations().
+
+from contextlib import contextmanager
+import gc
+import time
+
+from scheduler import JitterStats
+from xplane import measure_allocations
+
+
+class GCGuard:
+
+    def __init__(self, threshold=None, clock=time.perf_counter):
+
+        # threshold: container allocations that make a safe point collect
+        #            (the gen0 threshold of the collector by default)
+
+        self.clock = clock
+        self.thresholds = gc.get_threshold()
+        self.threshold = threshold or self.thresholds[0]
+        self.active = False
+        self.enabled = True           # collector state before start()
+        self.critical = False
+        self.collecting = False
+        self.collections = [0, 0, 0]  # at safe points, per generation
+        self.unplanned = 0            # collections outside safe points
+        self.deferred = 0             # safe points skipped being critical
+        self.pauses = JitterStats()   # seconds per safe point collection
+
+    def start(self):
+
+        # Collects once, moves every object alive to the permanent
+        # generation and turns automatic collection off. Call it when the
+        # setup is done, before the first packet.
+
+        self.enabled = gc.isenabled()
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        gc.callbacks.append(self._callback)
+        self.active = True
+
+    def stop(self):
+        if not self.active:
+            return
+        gc.callbacks.remove(self._callback)
+        gc.unfreeze()
+        if self.enabled:
+            gc.enable()
+        self.active = False
+        self.critical = False
+
+    def _callback(self, phase, info):
+        if phase == 'start' and not self.collecting:
+            self.unplanned += 1
+
+    def set_critical(self, critical):
+        self.critical = critical
+
+    @contextmanager
+    def critical_section(self):
+        previous = self.critical
+        self.critical = True
+        try:
+            yield self
+        finally:
+            self.critical = previous
+
+    def safe_point(self):
+
+        # Runs the collection automatic collection would have run by now,
+        # unless a critical phase is flown. Returns the generation
+        # collected, -1 if none.
+
+        if not self.active:
+            return -1
+        count = gc.get_count()
+        if count[0] < self.threshold:
+            return -1
+        if self.critical:
+            self.deferred += 1
+            return -1
+        t0, t1, t2 = self.thresholds
+        if count[1] >= t1:
+            generation = 2 if count[2] >= t2 else 1
+        else:
+            generation = 0
+        clock = self.clock
+        self.collecting = True
+        start = clock()
+        gc.collect(generation)
+        self.pauses.add(clock() - start)
+        self.collecting = False
+        self.collections[generation] += 1
+        return generation
+
+    def report(self):
+        pauses = self.pauses.summary()
+        return 'gc: {0} collections at safe points (gen0/1/2 {1}), ' \
+               '{2} deferred by critical phases, {3} unplanned, pause ' \
+               'p50 {4:.0f} us max {5:.0f} us, {6} frozen objects'.format(
+                   sum(self.collections),
+                   '/'.join(str(n) for n in self.collections), self.deferred,
+                   self.unplanned, pauses['p50'], pauses['max'],
+                   gc.get_freeze_count())
+
+
+def check_tick(ticks=2000, batch=50, mode=None):
+
+    # Regression check of the whole steady-state tick over the loopback
+    # interface: receive a DATA@ packet, step a Flight, send its
+    # controls. Returns measure_allocations() of the tick.
+
+    import socket
+    from phases import Flight, Phase
+    from xplane import SEND_INCREMENTAL, Receiver, Sender, sample_packet
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    xplane = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    xplane.bind(('127.0.0.1', 0))
+    xplane.setblocking(False)
+    receiver = Receiver(sock=rx)
+    sender = Sender(port=xplane.getsockname()[1],
+                    mode=mode or SEND_INCREMENTAL)
+    packet = sample_packet(1)
+    addr = rx.getsockname()
+    sink = bytearray(4096)
+
+    def hold_roll(i, c, f):
+        c.ailrn = -i.roll / 50
+        c.elev = 0.3 - i.pitch / 100
+
+    guard = GCGuard()
+    flight = Flight([Phase('flare', lambda i, f: False, hold_roll,
+                           critical=True)], verbose=False, guard=guard)
+
+    def prepare(n):
+        while True: # drop the commands sent by the last batch
+            try:
+                xplane.recv_into(sink)
+            except BlockingIOError:
+                break
+        for k in range(n):
+            rx.sendto(packet, addr)
+
+    def tick():
+        instr = receiver.receive()
+        flight.step(instr)
+        sender.send(flight.controls, '127.0.0.1')
+        guard.safe_point()
+
+    guard.start()
+    try:
+        return measure_allocations(tick, ticks, batch, prepare)
+    finally:
+        guard.stop()
+        rx.close()
+        xplane.close()
+        sender.sock.close()
+
+
+if __name__ == '__main__':
+
+    # The tick must stay allocation-free: a few hundred bytes of float and
+    # int objects at most, and no container object left behind
+
+    growth, peak, blocks = check_tick()
+    print('tick: growth {0} B, peak {1} B per 50 ticks, {2} containers'
+          .format(growth, peak, blocks))
+    assert peak < 1024 and growth < 1024 and blocks <= 0, \
+        (growth, peak, blocks)
+
+    # Something allocating in the tick is caught
+
+    leak = []
+    growth, peak, blocks = measure_allocations(lambda: leak.append([0.5]),
+                                               ticks=500)
+    assert blocks >= 500 and growth > 500 * 50
+
+    # Garbage piling up while critical is collected at the first safe
+    # point after the critical phase, and only there
+
+    guard = GCGuard(threshold=100)
+    guard.start()
+    try:
+        with guard.critical_section():
+            for k in range(1000):
+                cycle = [None]
+                cycle[0] = cycle
+                assert guard.safe_point() == -1
+        assert guard.deferred > 0 and sum(guard.collections) == 0
+        assert guard.safe_point() >= 0 and guard.safe_point() == -1
+        assert sum(guard.collections) == 1 and guard.unplanned == 0
+        gc.collect() # unplanned
+        assert guard.unplanned == 1
+        print(guard.report())
+    finally:
+        guard.stop()
+    assert gc.isenabled() and gc.get_freeze_count() == 0
+
+    # The collector is left as start() found it
+
+    gc.disable()
+    guard = GCGuard()
+    guard.start()
+    guard.stop()
+    assert not gc.isenabled()
+    gc.enable()
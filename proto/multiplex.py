@@ -0,0 +1,195 @@
+# File: multiplex.py
+
+# Flies many X-Plane instances from one process.
+#
+# Every Session owns its UDP port, its Receiver (and so its Instruments),
+# its Controls and its flight. One Multiplexer waits on all the sockets
+# with selectors (epoll on Linux) and steps the session whose packet came
+# in: decode, resume its flight, send its commands.
+#
+# A flight is a generator function. Each "yield" plays the part of
+# maintain(): the flight resumes on the next packet and its controls are
+# sent right after. Yield NORESTART instead for maintain_norestart():
+#
+#     def fly(session):
+#         while session.instruments.kias < 160:
+#             yield NORESTART
+#         while session.instruments.alt_agl < 100:
+#             session.controls.elev = 0.3
+#             yield
+
+import selectors
+import socket
+import time
+
+from xplane import AUTOPILOT_IP, XPLANE_PORT, Controls, Receiver, Sender
+
+
+NORESTART = 'norestart'
+
+
+class Session:
+
+    def __init__(self, port, fly, ip=AUTOPILOT_IP, name=None,
+                 xplane_port=XPLANE_PORT, send_sock=None):
+
+        # port: UDP port this X-Plane instance sends its DATA@ packets to
+        # fly: generator function fly(session), the flight logic
+        # name: label used in reports (the port by default)
+        # xplane_port: port the X-Plane instance listens on
+        # send_sock: socket shared by the sessions for sending (optional)
+
+        self.name = name if name is not None else str(port)
+        self.receiver = Receiver(ip, port)
+        self.sender = Sender(sock=send_sock, port=xplane_port)
+        self.fly = fly
+        self.flight = None
+        self.controls = None
+        self.restart = True
+        self.flights = 0   # number of (re)starts
+        self.busy = 0.0    # seconds spent stepping this session
+
+    @property
+    def instruments(self):
+        return self.receiver.front
+
+    def start(self):
+        print('*** start of simulation *** ({0})'.format(self.name))
+        self.controls = Controls()
+        self.flight = self.fly(self)
+        self.flights += 1
+        self.resume()
+
+    def resume(self):
+        try:
+            self.restart = next(self.flight) != NORESTART
+        except StopIteration:
+            self.flight = None
+
+    def step(self):
+
+        # Called when the socket is readable: reads every queued packet,
+        # resumes the flight and sends the commands
+
+        instr = self.receiver.poll()
+        if self.flight is None:
+            return
+        if self.restart and instr.mph < 1 and instr.alt_agl < 50:
+            self.start() # detect when plane crashes and is reset
+        else:
+            self.resume()
+        if self.receiver.peer is not None:
+            self.sender.send(self.controls, self.receiver.peer[0])
+
+    def close(self):
+        self.receiver.sock.close()
+
+
+class Multiplexer:
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.sessions = []
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.steps = 0
+
+    def add(self, port, fly, **kwargs):
+
+        # Creates, registers and starts a session, see Session
+
+        kwargs.setdefault('send_sock', self.send_sock)
+        session = Session(port, fly, **kwargs)
+        self.selector.register(session.receiver.sock, selectors.EVENT_READ,
+                               session)
+        self.sessions.append(session)
+        session.start()
+        return session
+
+    def remove(self, session):
+        self.selector.unregister(session.receiver.sock)
+        self.sessions.remove(session)
+        session.close()
+
+    def poll(self, timeout=None):
+
+        # Waits up to timeout seconds and steps every session that received
+        # packets. Returns the number of sessions stepped.
+
+        clock = time.perf_counter
+        events = self.selector.select(timeout)
+        for key, mask in events:
+            session = key.data
+            start = clock()
+            session.step()
+            session.busy += clock() - start
+        for session in self.sessions:
+            session.receiver.tick() # outages and dumps of silent links
+        self.steps += len(events)
+        return len(events)
+
+    def run(self, duration=None):
+
+        # Steps the sessions forever, or for duration seconds
+
+        end = None if duration is None else time.perf_counter() + duration
+        while end is None or time.perf_counter() < end:
+            self.poll(1.0 if end is None else
+                      max(0.0, min(1.0, end - time.perf_counter())))
+
+    def close(self):
+        for session in list(self.sessions):
+            self.remove(session)
+        self.selector.close()
+        self.send_sock.close()
+
+
+if __name__ == '__main__':
+    from xplane import sample_packet
+
+    # 48 sessions flying the same short flight against a stand-in sending
+    # one packet to every session per round
+
+    def fly(session):
+        c = session.controls
+        c.thro1 = 1
+        while session.instruments.kias < 1000:
+            c.ailrn = -session.instruments.roll / 50
+            yield NORESTART
+
+    count = 48
+    rounds = 500
+    mux = Multiplexer()
+    sessions = [mux.add(0, fly, ip='127.0.0.1', name='sim{0}'.format(n))
+                for n in range(count)]
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.setblocking(False)
+    for session in sessions:
+        session.sender.port = sink.getsockname()[1]
+    xplane = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    targets = [s.receiver.sock.getsockname() for s in sessions]
+
+    start = time.perf_counter()
+    for step in range(rounds):
+        packet = sample_packet(step)
+        for target in targets:
+            xplane.sendto(packet, target)
+        stepped = 0
+        while stepped < count:
+            stepped += mux.poll(1.0)
+        while True:
+            try:
+                sink.recv(4096)
+            except BlockingIOError:
+                break
+    elapsed = time.perf_counter() - start
+
+    busy = sum(s.busy for s in sessions)
+    packets = sum(s.receiver.packets for s in sessions)
+    assert packets == count * rounds
+    assert all(s.instruments.kias == 150 + rounds - 1 for s in sessions)
+    print('{0} sessions, {1} packets in {2:.2f} s (stand-in included); '
+          '{3:.1f} us per packet in sessions, {4:.0f} packets/s per core'
+          .format(count, packets, elapsed, busy / packets * 1e6,
+                  packets / busy))
+    mux.close()
@@ -0,0 +1,288 @@
+# File: phases.py
+
+# Phase state machine for flight plans.
+#
+# fly() in the scripts is a chain of blocking loops:
+#
+#     while instruments.alt_agl < 1000:
+#         turn(...)
+#         maintain()
+#
+# Here the same plan is a list of Phase objects, each an entry action, a
+# per-tick control law and an exit predicate, and Flight.step() advances
+# it by one tick without ever blocking. So phases can be timed (ticks, CPU
+# and flight time per phase), a flight can resume at any phase after a
+# reset, and one loop can step many flights (see Flight.generator for
+# multiplex.Multiplexer).
+#
+# Callbacks take the instruments, the controls and the Flight, whose vars
+# dict keeps values shared between phases (the takeoff heading...):
+#
+#     enter(i, c, f)   once, when the phase starts
+#     until(i, f)      true when the phase is over, checked every tick
+#     law(i, c, f)     every tick the phase is not over
+
+from clock import platform_time
+from multiplex import NORESTART
+from xplane import Controls
+
+
+class Phase:
+
+    def __init__(self, name, until, law=None, enter=None, restart=True,
+                 critical=False):
+
+        # name: printed when the phase starts
+        # restart: start the flight over when the plane stops on the
+        #          ground (crash or reset), like maintain(); False behaves
+        #          like maintain_norestart()
+        # critical: no garbage collection while the phase is flown, when
+        #           the Flight has a lowlatency.GCGuard
+
+        self.name = name
+        self.until = until
+        self.law = law
+        self.enter = enter
+        self.restart = restart
+        self.critical = critical
+
+
+# What one phase cost over a flight
+
+class PhaseStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.entries = 0
+        self.ticks = 0
+        self.cpu = 0.0       # seconds spent in until, law and enter
+        self.duration = 0.0  # seconds of Instruments.time spent in the phase
+        self.last_duration = 0.0
+
+
+class Flight:
+
+    def __init__(self, plan, controls=None, name=None, verbose=True,
+                 clock=platform_time, guard=None):
+
+        # plan: list of Phase, flown in order
+        # controls: Controls the laws write to (new ones when None)
+        # verbose: print the phase names as the scripts did
+        # guard: lowlatency.GCGuard told when critical phases start and end
+
+        self.plan = plan
+        self.index = dict((phase.name, k) for k, phase in enumerate(plan))
+        self.controls = controls if controls is not None else Controls()
+        self.name = name
+        self.verbose = verbose
+        self.clock = clock
+        self.guard = guard
+        self.vars = {}
+        self.stats = [PhaseStats(phase.name) for phase in plan]
+        self.current = None  # index of the active phase, None before start
+        self.entered = 0.0   # Instruments.time when it started
+        self.pending = 0     # phase to enter on the next tick
+        self.restarts = 0
+        self.ticks = 0
+
+    @property
+    def phase(self):
+        if self.current is None or self.current >= len(self.plan):
+            return None
+        return self.plan[self.current]
+
+    def done(self):
+        return self.current is not None and self.current >= len(self.plan)
+
+    def resume(self, name):
+
+        # Starts the given phase on the next tick, keeping vars: the quick
+        # way back into a flight after a reset to a point mid-air
+
+        self.pending = self.index[name]
+        self.current = None
+
+    def restart(self):
+        self.controls.__init__()
+        self.vars.clear()
+        self.restarts += 1
+        self.resume(self.plan[0].name)
+
+    def _enter(self, k, instr):
+        self.current = k
+        self.entered = instr.time
+        if k >= len(self.plan):
+            if self.guard is not None:
+                self.guard.set_critical(False)
+            return
+        phase = self.plan[k]
+        if self.guard is not None:
+            self.guard.set_critical(phase.critical)
+        self.stats[k].entries += 1
+        if self.verbose:
+            if self.name is None:
+                print(phase.name)
+            else:
+                print('{0}: {1}'.format(self.name, phase.name))
+        if phase.enter is not None:
+            phase.enter(instr, self.controls, self)
+
+    def _leave(self, instr):
+        stats = self.stats[self.current]
+        stats.last_duration = instr.time - self.entered
+        stats.duration += stats.last_duration
+
+    def step(self, instr):
+
+        # Advances the flight by one tick on fresh instruments. Returns
+        # False once the last phase is over.
+
+        clock = self.clock
+        start = clock()
+        self.ticks += 1
+
+        if self.current is None:
+            self._enter(self.pending, instr)
+        else:
+            phase = self.phase
+            if phase is not None and phase.restart and \
+               instr.mph < 1 and instr.alt_agl < 50:
+                if self.verbose:
+                    print('*** start of simulation ***')
+                self._leave(instr)
+                self.restart()
+                self._enter(self.pending, instr)
+
+        # Like the while conditions of the scripts, an exit is tested on
+        # the instruments of the tick the phase starts in, so several
+        # phases may end within one tick
+
+        controls = self.controls
+        while True:
+            k = self.current
+            if k >= len(self.plan):
+                return False
+            phase = self.plan[k]
+            if not phase.until(instr, self):
+                break
+            self._leave(instr)
+            self.stats[k].cpu += clock() - start
+            start = clock()
+            self._enter(k + 1, instr)
+
+        if phase.law is not None:
+            phase.law(instr, controls, self)
+        stats = self.stats[k]
+        stats.ticks += 1
+        stats.cpu += clock() - start
+        return True
+
+    def generator(self, session):
+
+        # Generator flight for multiplex.Multiplexer; the Flight does its
+        # own restart detection:
+        #
+        #     mux.add(port, lambda s: Flight(plan, s.controls).generator(s))
+
+        while True:
+            yield NORESTART # wait for the next packet
+            if not self.step(session.instruments):
+                return
+
+    def report(self):
+        lines = ['{0:<44} {1:>5} {2:>7} {3:>9} {4:>9}'.format(
+            'phase', 'runs', 'ticks', 'time s', 'cpu us/t')]
+        for s in self.stats:
+            lines.append('{0:<44} {1:>5} {2:>7} {3:>9.1f} {4:>9.2f}'.format(
+                s.name[:44], s.entries, s.ticks, s.duration,
+                s.cpu / s.ticks * 1e6 if s.ticks else 0.0))
+        return '\n'.join(lines)
+
+
+def run(flight, receiver, sender, predictor=None, estimator=None):
+
+    # Flies one aircraft forever: one step per packet, like autopilot().
+    # With a GCGuard, collections run once the command is sent.
+
+    # predictor: predictor.Predictor the phases see the instruments
+    #            through, extrapolated to when the command acts
+    # estimator: estimator.KalmanEstimator smoothing the instruments
+    #            first
+
+    guard = flight.guard
+    while True:
+        instr = receiver.receive()
+        if estimator is not None:
+            instr = estimator.filter(instr)
+        if predictor is not None:
+            instr = predictor.predict(instr)
+        if not flight.step(instr):
+            flight.restart()
+        sender.send(flight.controls, receiver.peer[0])
+        if predictor is not None:
+            predictor.sent()
+        if guard is not None:
+            guard.safe_point()
+
+
+if __name__ == '__main__':
+    import socket
+    from xplane import TIME_SIM, Receiver, sample_packet
+
+    # A three-phase plan over the sample packets (kias 150 + step, alt_agl
+    # 567 + step, one packet every 50 ms of sim time)
+
+    def hold_roll(i, c, f):
+        c.ailrn = -i.roll / 50
+
+    plan = [
+        Phase('take off', lambda i, f: i.kias >= 160, hold_roll,
+              lambda i, c, f: setattr(c, 'thro1', 1), restart=False),
+        Phase('climb', lambda i, f: i.alt_agl >= 600, hold_roll),
+        Phase('cruise', lambda i, f: i.alt_agl >= f.vars['start_alt'] + 20,
+              hold_roll, lambda i, c, f: f.vars.update(start_alt=i.alt_agl)),
+    ]
+    r = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
+                 time_source=TIME_SIM)
+    flight = Flight(plan, verbose=False)
+    step = 0
+    while flight.step(r.feed(sample_packet(step, times=True))):
+        step += 1
+    ticks = [s.ticks for s in flight.stats]
+    assert ticks == [10, 23, 20] and step == 53, (ticks, step)
+    assert abs(flight.stats[1].duration - 1.15) < 1e-4
+    assert flight.controls.thro1 == 1
+    print(flight.report())
+
+    # Resuming skips the earlier phases; an exit already met passes on to
+    # the next phase within the same tick
+
+    flight.resume('climb')
+    assert flight.step(r.front) and flight.phase.name == 'cruise'
+    assert flight.stats[1].entries == 2 and flight.stats[2].entries == 2
+
+    # One loop stepping four flights
+
+    from multiplex import Multiplexer
+    mux = Multiplexer()
+    flights = []
+
+    def fly(session):
+        flight = Flight(plan, session.controls, session.name, verbose=False)
+        flights.append(flight)
+        return flight.generator(session)
+
+    sessions = [mux.add(0, fly, ip='127.0.0.1', name='sim{0}'.format(n))
+                for n in range(4)]
+    xplane = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for step in range(60):
+        for session in sessions:
+            xplane.sendto(sample_packet(step, times=True),
+                          session.receiver.sock.getsockname())
+        stepped = 0
+        while stepped < len(sessions):
+            stepped += mux.poll(1.0)
+    assert all(f.done() for f in flights)
+    assert [s.ticks for s in flights[0].stats] == ticks
+    mux.close()
+    xplane.close()
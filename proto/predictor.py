@@ -0,0 +1,340 @@
+# File: predictor.py
+
+# Latency-compensating state predictor.
+#
+# Between the moment a DATA@ packet is stamped and the moment the command
+# computed from it takes effect in X-Plane, the aircraft keeps moving, so
+# turn(), stabilize_roll() and PID.run all act on a stale state. Predictor
+# extrapolates the attitude, altitude and position fields of Instruments
+# forward by that latency using their recent rates:
+#
+#     horizon = (now - instr.time) + lead + actuation
+#
+# where now - instr.time is the age of the data when the law runs, lead
+# the measured time from there to the send (averaged over the last ticks)
+# and actuation a fixed allowance for what cannot be measured here: the
+# packet's way from X-Plane, the command's way back and X-Plane applying
+# it, one packet period (50 ms at 20 Hz) by default. Every
+# new packet also scores the previous prediction: the value predicted for
+# the horizon against the measured one (interpolated between the two
+# packets around it), next to the error of simply holding the old value,
+# so the gain of the compensation is logged, not assumed.
+#
+# The measured age needs instr.time and clock in one time domain, and
+# only the kernel arrival stamps (Receiver(time_source=TIME_KERNEL),
+# converted to platform_time) make it mean anything: with TIME_HOST the
+# stamp is taken when the state is published, right before predict(), so
+# the age is a few microseconds and the horizon is all actuation. Sim
+# time (TIME_SIM) or a mismatched clock gives ages that are negative or
+# seconds long; the first such age raises a warning and the horizon falls
+# back to fallback seconds for that tick. Give latency explicitly to skip
+# the measurement altogether.
+#
+#     predictor = Predictor()
+#     instr = receiver.receive()
+#     law(predictor.predict(instr), controls)
+#     sender.send(controls, ip)
+#     predictor.sent()
+
+from array import array
+import json
+import math
+import warnings
+
+from clock import platform_time
+from xplane import FIELD_INDEX, Instruments
+
+
+# Fields extrapolated, and those among them that wrap around 360 degrees
+
+PREDICTED = ('pitch', 'roll', 'hding_true', 'hding_mag', 'alt_msl',
+             'alt_agl', 'alt_ind', 'lat', 'lon')
+HEADINGS = ('hding_true', 'hding_mag')
+
+
+class Predictor:
+
+    def __init__(self, fields=PREDICTED, smoothing=0.5, actuation=0.05,
+                 latency=None, clock=platform_time, max_horizon=0.5,
+                 dump=None, dump_period=10.0, fallback=0.05, max_age=1.0):
+
+        # fields: Instruments fields to extrapolate
+        # smoothing: weight of the newest rate in the rate average (1 for
+        #            the raw last difference)
+        # actuation: seconds from X-Plane stamping a packet to its arrival,
+        #            plus from sending a command to X-Plane applying it
+        # latency: fixed horizon in seconds instead of the measured one
+        #          (needed when Instruments.time is sim time)
+        # clock: clock of Instruments.time, for the measured horizon
+        # max_horizon: longest extrapolation, in seconds
+        # fallback: horizon in seconds when the measured age of the data is
+        #           implausible (negative or over max_age seconds)
+        # dump: path of a file receiving one JSON line of prediction
+        #       errors per dump_period seconds
+
+        self.fields = fields
+        self.index = [FIELD_INDEX[f] for f in fields]
+        self.wraps = [f in HEADINGS for f in fields]
+        self.smoothing = smoothing
+        self.actuation = actuation
+        self.latency = latency
+        self.clock = clock
+        self.max_horizon = max_horizon
+        self.fallback = fallback
+        self.max_age = max_age
+        self.fallbacks = 0                     # implausible ages seen
+        self.dump = dump
+        self.dump_period = dump_period
+
+        n = len(fields)
+        self.predicted = Instruments()
+        self.last = array('d', bytes(8 * n))   # values of the last packet
+        self.rates = array('d', bytes(8 * n))  # per second
+        self.time = None                       # time of the last packet
+        self.horizon = 0.0                     # of the last prediction
+        self.lead = 0.0                        # average predict to send
+        self.predicted_at = None
+
+        # Prediction error statistics since the last reset
+
+        self.count = 0
+        self.sq_error = array('d', bytes(8 * n))
+        self.sq_hold = array('d', bytes(8 * n))
+        self.max_error = array('d', bytes(8 * n))
+        self.window_start = None
+
+    def reset(self):
+        self.time = None
+        self.lead = 0.0
+        self.reset_errors()
+
+    def reset_errors(self):
+        n = len(self.fields)
+        self.count = 0
+        self.sq_error[:] = array('d', bytes(8 * n))
+        self.sq_hold[:] = array('d', bytes(8 * n))
+        self.max_error[:] = array('d', bytes(8 * n))
+
+    def update(self, instr):
+
+        # Takes in a new packet: scores the last prediction, then updates
+        # the rates. predict() calls it whenever instr.time changed.
+
+        values = instr.values
+        t = instr.time
+        if self.time is None:
+            for k, i in enumerate(self.index):
+                self.last[k] = values[i]
+            self.time = t
+            self.window_start = t
+            return
+        dt = t - self.time
+        if dt <= 0:
+            return
+
+        # The last prediction aimed at self.time + horizon; the measured
+        # value there is interpolated between the two packets, or taken at
+        # this packet when the horizon reaches beyond it
+
+        tau = min(self.horizon, dt)
+        score = tau > 0
+        alpha = self.smoothing
+        last = self.last
+        rates = self.rates
+        for k, i in enumerate(self.index):
+            delta = values[i] - last[k]
+            if self.wraps[k]:
+                delta = (delta + 180) % 360 - 180
+            rate = delta / dt
+            if score:
+                error = (rates[k] - rate) * tau   # predicted - measured
+                hold = rate * tau                 # measured - held value
+                self.sq_error[k] += error * error
+                self.sq_hold[k] += hold * hold
+                if abs(error) > self.max_error[k]:
+                    self.max_error[k] = abs(error)
+            rates[k] += alpha * (rate - rates[k])
+            last[k] = values[i]
+        if score:
+            self.count += 1
+        self.time = t
+
+        if self.dump is not None and t - self.window_start >= self.dump_period:
+            self.write_dump(t)
+
+    def predict(self, instr):
+
+        # Returns Instruments extrapolated to the time the command computed
+        # from them will act. The result is overwritten by the next call.
+
+        if instr.time != self.time:
+            self.update(instr)
+        if self.latency is not None:
+            horizon = self.latency
+        else:
+            now = self.clock()
+            self.predicted_at = now
+            age = now - instr.time
+            if 0 <= age <= self.max_age:
+                horizon = age + self.lead + self.actuation
+            else:
+                if not self.fallbacks:
+                    warnings.warn('data age {0:.3g} s: Instruments.time and '
+                                  'the clock are not in one time domain, '
+                                  'predicting {1} s ahead instead'.format(
+                                      age, self.fallback))
+                self.fallbacks += 1
+                horizon = self.fallback
+        if horizon > self.max_horizon:
+            horizon = self.max_horizon
+        elif horizon < 0:
+            horizon = 0.0
+        self.horizon = horizon
+
+        out = self.predicted
+        out.values[:] = instr.values
+        values = out.values
+        rates = self.rates
+        for k, i in enumerate(self.index):
+            x = values[i] + rates[k] * horizon
+            if self.wraps[k]:
+                x %= 360
+            values[i] = x
+        return out
+
+    def sent(self):
+
+        # Call right after sending the command computed from the last
+        # prediction, to measure the lead
+
+        if self.predicted_at is not None:
+            self.lead += 0.1 * (self.clock() - self.predicted_at - self.lead)
+            self.predicted_at = None
+
+    def errors(self):
+
+        # Returns {field: (rms predicted, rms held, max predicted)}, the
+        # errors at the horizon of the compensated and uncompensated values
+
+        n = self.count or 1
+        return dict((f, (math.sqrt(self.sq_error[k] / n),
+                         math.sqrt(self.sq_hold[k] / n), self.max_error[k]))
+                    for k, f in enumerate(self.fields))
+
+    def report(self):
+        lines = ['prediction over {0} packets, horizon {1:.1f} ms (lead '
+                 '{2:.2f} ms, {3} fallbacks)'.format(
+                     self.count, self.horizon * 1e3, self.lead * 1e3,
+                     self.fallbacks),
+                 '{0:<12} {1:>12} {2:>12} {3:>12}'.format(
+                     'field', 'rms error', 'rms stale', 'max error')]
+        errors = self.errors()
+        for f in self.fields:
+            rms, hold, worst = errors[f]
+            lines.append('{0:<12} {1:>12.6g} {2:>12.6g} {3:>12.6g}'.format(
+                f, rms, hold, worst))
+        return '\n'.join(lines)
+
+    def write_dump(self, now):
+
+        # Appends the errors of the last window and starts a new one
+
+        line = {'time': now, 'packets': self.count, 'horizon': self.horizon,
+                'lead': self.lead}
+        for f, (rms, hold, worst) in self.errors().items():
+            line[f] = {'rms': rms, 'rms_stale': hold, 'max': worst}
+        with open(self.dump, 'a') as out:
+            out.write(json.dumps(line) + '\n')
+        self.window_start = now
+        self.reset_errors()
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+
+    # A coordinated turn sampled at 20 Hz: roll oscillating slowly, heading
+    # turning through north, altitude climbing. Commands act 60 ms after
+    # the sample.
+
+    period, delay = 0.05, 0.06
+
+    def state(t, instr):
+        instr.time = t
+        instr.roll = 25 * math.sin(0.5 * t)
+        instr.pitch = 3 + 2 * math.sin(0.3 * t)
+        instr.hding_true = (350 + 3 * t) % 360
+        instr.alt_msl = 1000 + 10 * t
+        instr.lat = 47.46 + 0.0001 * t
+        instr.lon = -122.3 + 0.0002 * t
+        return instr
+
+    path = os.path.join(tempfile.mkdtemp(), 'prediction.jsonl')
+    predictor = Predictor(latency=delay, dump=path, dump_period=5.0)
+    instr = Instruments()
+    actual = Instruments()
+    stale = predicted = 0.0
+    for k in range(400):
+        t = k * period
+        p = predictor.predict(state(t, instr))
+        if k > 10:
+            truth = state(t + delay, actual)
+            stale = max(stale, abs(instr.roll - truth.roll))
+            predicted = max(predicted, abs(p.roll - truth.roll))
+            assert abs((p.hding_true - truth.hding_true + 180) % 360 - 180) \
+                < 1e-3
+    print('roll {0:.0f} ms ahead: stale {1:.3f} deg, predicted {2:.4f} deg'
+          .format(delay * 1e3, stale, predicted))
+    assert predicted < stale / 10
+    print(predictor.report())
+    rms, hold, worst = predictor.errors()['roll']
+    assert rms < hold / 10
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 3 and lines[0]['roll']['rms'] < lines[0]['roll'][
+        'rms_stale']
+    os.remove(path)
+
+    # Measured horizon: the age of the data plus the lead to the send
+
+    clock = [100.0]
+    live = Predictor(clock=lambda: clock[0], actuation=0.01)
+    for k in range(50):
+        clock[0] = 100.0 + k * period + 0.004  # law runs 4 ms after sample
+        live.predict(state(100.0 + k * period, instr))
+        clock[0] += 0.001                      # sent 1 ms later
+        live.sent()
+    assert abs(live.horizon - 0.015) < 1e-3, live.horizon
+    assert live.fallbacks == 0
+
+    # Host stamps taken just before predict() measure next to nothing:
+    # the default allowance still predicts a packet period ahead
+
+    host = Predictor(clock=lambda: clock[0])
+    for k in range(5):
+        clock[0] = 100.0 + k * period
+        host.predict(state(clock[0] - 1e-4, instr))
+    assert 0.05 <= host.horizon < 0.051, host.horizon
+
+    # Stamps from another time domain (sim time against platform_time)
+    # fall back to the fixed horizon, with one warning
+
+    other = Predictor(clock=lambda: clock[0], fallback=0.05)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        for k in range(20):
+            clock[0] = 100.0 + k * period
+            other.predict(state(k * period + 5000.0, instr)) # ahead
+            other.sent()
+    assert len(caught) == 1 and other.fallbacks == 20
+    assert other.horizon == 0.05 and 'fallbacks' in other.report()
+
+    n = 20000
+    start = time.perf_counter()
+    for k in range(n):
+        instr.time = k * period
+        predictor.predict(instr)
+    print('predict and score: {0:.2f} us per packet'.format(
+        (time.perf_counter() - start) / n * 1e6))
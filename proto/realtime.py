@@ -0,0 +1,310 @@
+# File: realtime.py
+
+# Real-time execution mode for the control loop (Linux).
+#
+# The control loop shares the CPU with matplotlib, the X-Plane stand-in
+# and the rest of the host, and the kernel may preempt it at any tick.
+# RealTime asks for better: the control thread pinned to one core
+# (sched_setaffinity), the SCHED_FIFO real-time policy or at least a
+# higher nice priority, and optionally all memory locked in RAM
+# (mlockall) so a tick never waits on a page fault. Each request that is
+# not permitted (no root, no CAP_SYS_NICE, no Linux) is skipped and noted,
+# and leave() restores what was changed. Since "it helps" has to be
+# shown, enter() can measure the wake-up latency of a periodic tick
+# before and after:
+#
+#     rt = RealTime(cpu=3, lock_memory=True)
+#     rt.enter(measure=True)
+#     print(rt.report())
+#
+# Works with Python 2 and 3 (on Python 2 without affinity and policies,
+# the niceness set with os.nice). report() lists every step not taken.
+
+import ctypes
+import ctypes.util
+import os
+import sys
+
+from clock import _wall_time
+
+
+MCL_CURRENT = 1
+MCL_FUTURE  = 2
+
+
+def wakeup_latency(samples=2000, period=0.001, clock=None):
+
+    # Sleeps to samples deadlines period seconds apart, like a fixed-rate
+    # control tick, and returns the sorted delays of the wake-ups in
+    # seconds
+
+    import time
+    clock = clock or _wall_time()
+    delays = []
+    deadline = clock() + period
+    for k in range(samples):
+        delay = deadline - clock()
+        if delay > 0:
+            time.sleep(delay)
+        delays.append(clock() - deadline)
+        deadline += period
+    delays.sort()
+    return delays
+
+
+def percentiles(ordered, points=(50, 90, 99, 99.9)):
+
+    # Returns {p: value} over sorted samples, plus 'max'
+
+    result = {}
+    n = len(ordered)
+    for p in points:
+        result[p] = ordered[min(n - 1, int(p / 100.0 * n))]
+    result['max'] = ordered[-1]
+    return result
+
+
+def format_latency(name, ordered):
+    pct = percentiles(ordered)
+    return '{0:<8} p50 {1:7.1f}  p90 {2:7.1f}  p99 {3:7.1f}  ' \
+           'p99.9 {4:7.1f}  max {5:7.1f} us'.format(
+               name, pct[50] * 1e6, pct[90] * 1e6, pct[99] * 1e6,
+               pct[99.9] * 1e6, pct['max'] * 1e6)
+
+
+# Niceness of the process: os.getpriority and os.setpriority on Python 3,
+# the relative os.nice on Python 2
+
+def _get_nice():
+    if hasattr(os, 'getpriority'):
+        return os.getpriority(os.PRIO_PROCESS, 0)
+    return os.nice(0)
+
+
+def _set_nice(nice, current):
+    if hasattr(os, 'setpriority'):
+        os.setpriority(os.PRIO_PROCESS, 0, nice)
+    else:
+        os.nice(nice - current)
+
+
+class RealTime:
+
+    def __init__(self, cpu=None, fifo=True, priority=50, nice=-10,
+                 lock_memory=False):
+
+        # cpu: core to pin the calling thread to, None to leave it free
+        # fifo: ask for SCHED_FIFO at the given priority (1..99)
+        # nice: niceness to ask for when SCHED_FIFO is not granted, None
+        #       to leave it
+        # lock_memory: mlockall current and future pages
+
+        self.cpu = cpu
+        self.fifo = fifo
+        self.priority = priority
+        self.nice = nice
+        self.lock_memory = lock_memory
+
+        self.active = False
+        self.applied = []    # what was granted, for report()
+        self.skipped = []    # (what, why) of what was not
+        self.saved = {}      # settings to restore
+        self.before = None   # sorted wake-up delays, when measured
+        self.after = None
+
+    def _skip(self, what, error):
+        self.skipped.append((what, str(error)))
+
+    def _pin(self):
+        if not hasattr(os, 'sched_setaffinity'):
+            self._skip('affinity', 'not supported on this platform')
+            return
+        try:
+            self.saved['affinity'] = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, [self.cpu])
+            self.applied.append('pinned to cpu {0}'.format(self.cpu))
+        except (OSError, ValueError) as error:
+            self.saved.pop('affinity', None)
+            self._skip('affinity', error)
+
+    def _schedule(self):
+        if not self.fifo:
+            self._skip('SCHED_FIFO', 'not requested')
+        elif not hasattr(os, 'sched_setscheduler'):
+            self._skip('SCHED_FIFO', 'not supported on this platform')
+        else:
+            try:
+                policy = os.sched_getscheduler(0)
+                param = os.sched_getparam(0)
+                os.sched_setscheduler(0, os.SCHED_FIFO,
+                                      os.sched_param(self.priority))
+                self.saved['scheduler'] = (policy, param)
+                self.applied.append('SCHED_FIFO priority {0}'
+                                    .format(self.priority))
+                if self.nice is not None:
+                    self._skip('nice', 'not needed under SCHED_FIFO')
+                return
+            except (OSError, ValueError) as error:
+                self._skip('SCHED_FIFO', error)
+
+        # No real-time policy: a lower niceness is the next best thing
+
+        if self.nice is None:
+            self._skip('nice', 'not requested')
+            return
+        try:
+            current = _get_nice()
+            if self.nice < current:
+                _set_nice(self.nice, current)
+                self.saved['nice'] = current
+                self.applied.append('nice {0}'.format(self.nice))
+            else:
+                self._skip('nice', 'already at {0}'.format(current))
+        except OSError as error:
+            self._skip('nice', error)
+
+    def _lock(self):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or libc_name is None:
+            self._skip('mlockall', 'not supported on this platform')
+            return
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            self._skip('mlockall', os.strerror(ctypes.get_errno()))
+            return
+        self.saved['mlock'] = libc
+        self.applied.append('memory locked')
+
+    def enter(self, measure=False, samples=2000, period=0.001):
+
+        # Applies every setting permitted. With measure, the wake-up
+        # latency of a period tick is measured before and after.
+
+        if measure:
+            self.before = wakeup_latency(samples, period)
+        if self.cpu is not None:
+            self._pin()
+        else:
+            self._skip('affinity', 'no cpu given')
+        self._schedule()
+        if self.lock_memory:
+            self._lock()
+        self.active = True
+        if measure:
+            self.after = wakeup_latency(samples, period)
+        return self
+
+    def leave(self):
+
+        # Restores the settings changed by enter()
+
+        saved = self.saved
+        if 'mlock' in saved:
+            saved['mlock'].munlockall()
+        if 'scheduler' in saved:
+            policy, param = saved['scheduler']
+            os.sched_setscheduler(0, policy, param)
+        if 'nice' in saved:
+            try:
+                _set_nice(saved['nice'], _get_nice())
+            except OSError:
+                pass # raising the niceness back needs no privilege
+        if 'affinity' in saved:
+            os.sched_setaffinity(0, saved['affinity'])
+        self.saved = {}
+        self.active = False
+
+    def __enter__(self):
+        return self.enter()
+
+    def __exit__(self, *exc):
+        self.leave()
+
+    def report(self):
+        lines = ['real-time mode: ' + (', '.join(self.applied) or 'nothing '
+                                       'granted')]
+        for what, why in self.skipped:
+            lines.append('  {0} not applied: {1}'.format(what, why))
+        if self.before is not None:
+            lines.append('  wake-up latency of a 1 kHz tick:')
+            lines.append('  ' + format_latency('before', self.before))
+            lines.append('  ' + format_latency('after', self.after))
+        return '\n'.join(lines)
+
+
+USAGE = 'options: --realtime[=cpu] (pin to cpu, the last one by default, ' \
+        'and raise the priority), --mlock (lock memory too)'
+
+
+def from_args(argv):
+
+    # RealTime from the command line options of the autopilot scripts,
+    # None without --realtime:
+    #
+    #     --realtime[=cpu]   pin to cpu (the last one by default), raise
+    #                        the priority
+    #     --mlock            lock memory too
+
+    for arg in argv:
+        if arg == '--realtime' or arg.startswith('--realtime='):
+            if '=' in arg:
+                value = arg.split('=', 1)[1]
+                try:
+                    cpu = int(value)
+                except ValueError:
+                    cpu = -1
+                if cpu < 0:
+                    raise SystemExit('{0}: bad cpu {1!r}\n{2}'.format(
+                        os.path.basename(argv[0]), value, USAGE))
+            elif hasattr(os, 'sched_getaffinity'):
+                cpu = max(os.sched_getaffinity(0))
+            else:
+                cpu = None
+            return RealTime(cpu=cpu, lock_memory='--mlock' in argv)
+    return None
+
+
+if __name__ == '__main__':
+    assert from_args(['autopilot.py']) is None
+    assert from_args(['autopilot.py', '--realtime=0', '--mlock']).cpu == 0
+    for bad in ('--realtime=x', '--realtime=', '--realtime=-1'):
+        try:
+            from_args(['autopilot.py', bad])
+            raise AssertionError(bad)
+        except SystemExit as exit:
+            assert 'bad cpu' in str(exit) and USAGE in str(exit)
+
+    affinity = os.sched_getaffinity(0)
+    policy = os.sched_getscheduler(0)
+    niceness = os.getpriority(os.PRIO_PROCESS, 0)
+
+    rt = RealTime(cpu=max(affinity), lock_memory=True)
+    rt.enter(measure=True)
+    print(rt.report())
+    assert rt.applied or rt.skipped
+    if 'affinity' in rt.saved:
+        assert os.sched_getaffinity(0) == set([rt.cpu])
+    rt.leave()
+
+    # Everything is back as it was, privileged or not
+
+    assert os.sched_getaffinity(0) == affinity
+    assert os.sched_getscheduler(0) == policy
+    assert os.getpriority(os.PRIO_PROCESS, 0) >= niceness
+
+    # Python 2 has no os.getpriority: the niceness goes through os.nice,
+    # and nothing is skipped without a note
+
+    saved = os.getpriority, os.setpriority
+    del os.getpriority, os.setpriority
+    try:
+        rt = RealTime(fifo=False, nice=niceness - 1).enter()
+        assert set(what for what, why in rt.skipped) >= set(['affinity',
+                                                             'SCHED_FIFO'])
+        assert 'nice {0}'.format(niceness - 1) in rt.applied or \
+            'nice' in dict(rt.skipped)
+        print(rt.report())
+        rt.leave()
+    finally:
+        os.getpriority, os.setpriority = saved
+    assert os.getpriority(os.PRIO_PROCESS, 0) == niceness
@@ -0,0 +1,355 @@
+# File: scheduler.py
+
+# Fixed-rate control scheduler.
+#
+# With maintain() the control output rate is whatever rate X-Plane sends
+# at, and it stops when packets are lost. FixedRate ticks at a configured
+# rate on absolute deadlines start + k*period of a monotonic clock, so
+# timing errors never accumulate, and records how late every tick woke up.
+# control_loop() uses it to send commands computed from the freshest
+# Instruments at every tick, whether or not a packet arrived. MultiRate
+# runs the control laws of one tick at several rates: inner loops every
+# tick, outer loops and navigation at divided rates.
+
+from array import array
+from math import gcd
+import time
+
+
+# Keeps the last samples of a timing measurement in a preallocated array
+
+class JitterStats:
+
+    def __init__(self, size=4096):
+        self.samples = array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, x):
+        self.samples[self.count % self.size] = x
+        self.count += 1
+        self.total += x
+        if x > self.max:
+            self.max = x
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+
+        # p: percentile in 0..100 over the retained samples
+
+        n = min(self.count, self.size)
+        if n == 0:
+            return 0.0
+        ordered = sorted(self.samples[:n])
+        return ordered[min(n - 1, int(p / 100.0 * n))]
+
+    def summary(self, scale=1e6):
+
+        # Returns mean, p50, p99 and max, in microseconds by default
+
+        return dict(mean=self.mean() * scale,
+                    p50=self.percentile(50) * scale,
+                    p99=self.percentile(99) * scale,
+                    max=self.max * scale,
+                    count=self.count)
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+# Wakes up at a fixed rate on drift-free deadlines
+
+class FixedRate:
+
+    def __init__(self, rate, clock=time.perf_counter, spin=0.0002):
+
+        # rate: ticks per second (50, 100, 200...)
+        # clock: monotonic clock in seconds
+        # spin: the last part of each wait is busy-waited, in seconds,
+        #       to absorb the wake-up latency of time.sleep
+
+        self.period = 1.0 / rate
+        self.clock = clock
+        self.spin = spin
+        self.start = None
+        self.ticks = 0
+        self.overruns = 0  # deadlines skipped because a tick ran too long
+        self.jitter = JitterStats()
+
+    def deadline(self):
+        return self.start + self.ticks * self.period
+
+    def wait(self):
+
+        # Sleeps until the next deadline and returns how late it woke up
+
+        clock = self.clock
+        if self.start is None:
+            self.start = clock()
+        due = self.deadline()
+        now = clock()
+        if now - due > self.period:
+
+            # Fell behind by more than one period: skip the missed deadlines
+            # rather than firing them back to back.
+
+            missed = int((now - due) / self.period)
+            self.overruns += missed
+            self.ticks += missed
+            due = self.deadline()
+
+        remaining = due - now - self.spin
+        if remaining > 0:
+            time.sleep(remaining)
+        while clock() < due:
+            pass
+        late = clock() - due
+        self.jitter.add(late)
+        self.ticks += 1
+        return late
+
+    def report(self):
+        stats = self.jitter.summary()
+        stats['rate'] = 1.0 / self.period
+        stats['overruns'] = self.overruns
+        return ('{rate:.0f} Hz: {count} ticks, jitter mean {mean:.1f} us, '
+                'p50 {p50:.1f} us, p99 {p99:.1f} us, max {max:.1f} us, '
+                '{overruns} overruns'.format(**stats))
+
+
+# Control laws grouped by rate
+#
+# One tick of the base rate (every packet, or every FixedRate tick) runs
+# the inner loops; outer loops run every few ticks and navigation every
+# few dozen. A group runs on the ticks k where k % divider == offset, so
+# its timing stays locked to the base ticks, and the offsets of the slow
+# groups are spread so they do not all land on the same tick. On a tick
+# where several groups run, the slowest run first: navigation sets the
+# targets the outer loops follow, which set those of the inner loops.
+
+class RateGroup:
+
+    def __init__(self, name, divider, offset):
+        self.name = name
+        self.divider = divider
+        self.offset = offset
+        self.laws = []
+        self.runs = 0
+        self.cpu = JitterStats(1024)  # seconds per run
+
+
+class MultiRate:
+
+    def __init__(self, base_rate=50, clock=time.perf_counter):
+
+        # base_rate: rate in Hz at which tick() is called, used to turn
+        #            rates into dividers
+
+        self.base_rate = base_rate
+        self.clock = clock
+        self.groups = []
+        self.ticks = 0
+        self.cpu = JitterStats()  # seconds per tick, all groups
+
+    def group(self, name, rate=None, divider=None, offset=None):
+
+        # Returns the group called name, created on first use with a
+        # divider of the base rate (given directly or as a rate in Hz)
+
+        # offset: tick within the divider the group runs on, chosen to
+        #         balance the load when None
+
+        for g in self.groups:
+            if g.name == name:
+                return g
+        if divider is None:
+            divider = 1 if rate is None else \
+                      max(1, int(round(self.base_rate / float(rate))))
+        if offset is None:
+            offset = self._least_loaded(divider)
+        g = RateGroup(name, divider, offset % divider)
+        self.groups.append(g)
+        self.groups.sort(key=lambda g: -g.divider)
+        return g
+
+    def _least_loaded(self, divider):
+
+        # Offset whose ticks already carry the fewest slow groups
+
+        def load(offset):
+            return sum(1 for g in self.groups if g.divider > 1 and
+                       (offset - g.offset) % gcd(divider, g.divider) == 0)
+        return min(range(divider), key=load)
+
+    def add(self, law, name='inner', rate=None, divider=None, offset=None):
+
+        # law: law(instruments, controls)
+        # name, rate, divider, offset: see group()
+
+        self.group(name, rate, divider, offset).laws.append(law)
+        return law
+
+    def tick(self, instr, controls):
+
+        # Runs the groups due on this tick; usable as a control_loop law
+
+        clock = self.clock
+        k = self.ticks
+        tick_start = clock()
+        for g in self.groups:
+            if k % g.divider != g.offset:
+                continue
+            start = clock()
+            for law in g.laws:
+                law(instr, controls)
+            g.cpu.add(clock() - start)
+            g.runs += 1
+        self.cpu.add(clock() - tick_start)
+        self.ticks = k + 1
+
+    __call__ = tick
+
+    def report(self):
+        lines = ['{0:.0f} Hz base, {1} ticks, {2:.1f} us per tick '
+                 '(p99 {3:.1f} us, max {4:.1f} us)'.format(
+                     self.base_rate, self.ticks, self.cpu.mean() * 1e6,
+                     self.cpu.percentile(99) * 1e6, self.cpu.max * 1e6)]
+        for g in self.groups:
+            lines.append('  {0:<12} {1:6.1f} Hz  offset {2:<3} {3:7} runs  '
+                         '{4:7.1f} us/run  {5:6.2f} us/tick'.format(
+                             g.name, self.base_rate / g.divider, g.offset,
+                             g.runs, g.cpu.mean() * 1e6,
+                             g.cpu.total / max(1, self.ticks) * 1e6))
+        return '\n'.join(lines)
+
+
+def control_loop(receiver, sender, controls, law, rate, ticks=None,
+                 timer=None, guard=None, predictor=None, estimator=None):
+
+    # Sends controls at a fixed rate from the freshest Instruments
+
+    # receiver: xplane.Receiver, polled without waiting at every tick
+    # sender: xplane.Sender
+    # law: law(instruments, controls), called at every tick
+    # rate: control rate in Hz
+    # ticks: number of ticks to run, forever if None
+    # timer: FixedRate to use (created from rate when None)
+    # guard: lowlatency.GCGuard, collecting after the send of each tick
+    # predictor: predictor.Predictor extrapolating the instruments to when
+    #            the command acts (the freshest packet may be ticks old)
+    # estimator: estimator.KalmanEstimator smoothing the instruments first
+
+    if timer is None:
+        timer = FixedRate(rate)
+    while ticks is None or timer.ticks < ticks:
+        timer.wait()
+        instr = receiver.poll()
+        if receiver.peer is None:
+            continue # nowhere to send before the first packet
+        if estimator is not None:
+            instr = estimator.filter(instr)
+        if predictor is not None:
+            instr = predictor.predict(instr)
+        law(instr, controls)
+        sender.send(controls, receiver.peer[0])
+        if predictor is not None:
+            predictor.sent()
+        if guard is not None:
+            guard.safe_point()
+    return timer
+
+
+if __name__ == '__main__':
+    import socket
+    import threading
+    from xplane import Controls, Receiver, Sender, sample_packet
+
+    # A stand-in X-Plane sending 20 packets per second and counting the
+    # control packets it gets back
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    xplane = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    xplane.bind(('127.0.0.1', 0))
+    xplane.settimeout(0.2)
+    received = []
+    stop = threading.Event()
+
+    def simulator():
+        step = 0
+        next_send = time.perf_counter()
+        while not stop.is_set():
+            if time.perf_counter() >= next_send:
+                xplane.sendto(sample_packet(step), rx.getsockname())
+                step += 1
+                next_send += 0.05
+            try:
+                received.append(xplane.recv(4096))
+            except socket.timeout:
+                pass
+
+    thread = threading.Thread(target=simulator)
+    thread.start()
+
+    def law(i, c):
+        c.ailrn = -i.roll / 50
+
+    receiver = Receiver(sock=rx)
+    sender = Sender(port=xplane.getsockname()[1])
+    for rate in (50, 100, 200):
+        del received[:]
+        packets = receiver.packets
+        timer = control_loop(receiver, sender, Controls(), law, rate,
+                             ticks=rate)
+        time.sleep(0.05)
+        print('{0} ({1} commands for {2} packets)'.format(
+            timer.report(), len(received), receiver.packets - packets))
+    stop.set()
+    thread.join()
+
+    # Navigation at 2 Hz, heading at 10 Hz and roll every tick, against
+    # everything on every tick
+
+    import math
+
+    target = {'hding': 0.0, 'roll': 0.0}
+    runway = (math.radians(47.4647), math.radians(-122.3088))
+
+    def navigation(i, c):
+        lat, lon = math.radians(i.lat), math.radians(i.lon)
+        dlon = runway[1] - lon
+        y = math.sin(dlon) * math.cos(runway[0])
+        x = math.cos(lat) * math.sin(runway[0]) - \
+            math.sin(lat) * math.cos(runway[0]) * math.cos(dlon)
+        target['hding'] = math.degrees(math.atan2(y, x)) % 360
+
+    def heading(i, c):
+        err = (i.hding_true - target['hding'] + 180) % 360 - 180
+        target['roll'] = max(-30, min(30, -err))
+
+    def roll(i, c):
+        c.ailrn = (target['roll'] - i.roll) / 50
+
+    instr = receiver.front
+    controls = Controls()
+    single = MultiRate(50)
+    multi = MultiRate(50)
+    for law, name, rate in ((navigation, 'navigation', 2),
+                            (heading, 'outer', 10), (roll, 'inner', None)):
+        single.add(law, name)
+        multi.add(law, name, rate)
+    for step in range(10000):
+        single.tick(instr, controls)
+        multi.tick(instr, controls)
+    nav, outer, inner = multi.groups
+    assert (nav.divider, outer.divider, inner.divider) == (25, 5, 1)
+    assert (nav.runs, outer.runs, inner.runs) == (400, 2000, 10000)
+    assert (nav.offset - outer.offset) % 5 != 0 # never on the same tick
+    print('all laws every tick: ' + single.report())
+    print('multi-rate: ' + multi.report())
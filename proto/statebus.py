@@ -0,0 +1,291 @@
+# File: statebus.py
+
+# Shared-memory state bus for Instruments and Controls.
+#
+# The autopilot publishes its state into a multiprocessing.shared_memory
+# segment; dashboards, recorders and analysis scripts in other processes
+# attach to it by name and read consistent snapshots, with no socket, no
+# pickling and no lock on the writer side.
+#
+# Consistency comes from a seqlock: the writer makes the sequence number
+# odd, copies the values, then makes it even again. A reader copies the
+# values between two reads of the sequence number and starts over when it
+# was odd or changed. Writing never waits for readers. There are no
+# explicit memory barriers: this relies on stores, and loads, being seen
+# in program order, which only x86 guarantees. The bus is x86-only;
+# StateBus refuses to start on other machines (ARM, POWER...), where a
+# reader could see a torn snapshot under an even sequence number.
+#
+# Segment layout, native byte order:
+#
+#     0   uint64  sequence number (odd while a write is in progress)
+#     8   uint64  number of instrument values
+#     16  uint64  number of control values
+#     64  float64 Instruments.values, INSTRUMENT_FIELDS order
+#     ..  float64 Controls, CONTROL_FIELDS order
+
+from array import array
+from multiprocessing import shared_memory
+import operator
+import platform
+import struct
+
+from datagroups import control_fields
+from xplane import INSTRUMENT_FIELDS, Controls, Instruments
+
+
+BUS_NAME       = 'xplane-state'
+X86_MACHINES   = ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+HEADER_SIZE    = 64
+CONTROL_FIELDS = tuple(field for field, unit in control_fields())
+
+
+def _layout():
+    instr_size = 8 * len(INSTRUMENT_FIELDS)
+    controls_size = 8 * len(CONTROL_FIELDS)
+    return instr_size, controls_size, HEADER_SIZE + instr_size + controls_size
+
+
+def _untrack(shm):
+
+    # Before Python 3.13 the resource tracker of every process attaching a
+    # segment unlinks it when that process exits; only the writer may
+
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except (ImportError, AttributeError, KeyError):
+        pass
+
+
+class _Segment:
+
+    def __init__(self, shm):
+        self.shm = shm
+        instr_size, controls_size, size = _layout()
+        view = shm.buf
+        self.header = view[:HEADER_SIZE].cast('Q')
+        self.instr_view = view[HEADER_SIZE:HEADER_SIZE + instr_size].cast('d')
+        self.controls_view = view[HEADER_SIZE + instr_size:size]
+        self.controls_struct = struct.Struct('@{0}d'.format(len(CONTROL_FIELDS)))
+
+    def release(self):
+
+        # Views must go before the segment can be closed
+
+        self.header.release()
+        self.instr_view.release()
+        self.controls_view.release()
+        self.shm.close()
+
+
+# Writer side, owned by the autopilot process
+
+class StateBus(_Segment):
+
+    def __init__(self, name=BUS_NAME, replace=False):
+
+        # name: shared memory name readers attach to
+        # replace: unlink an existing segment of that name (left by a
+        #          crashed writer) instead of failing; only when no other
+        #          autopilot is publishing on it
+
+        machine = platform.machine().lower()
+        if machine not in X86_MACHINES:
+            raise RuntimeError('the state bus seqlock needs x86 memory '
+                               'ordering, not {0}'.format(machine))
+        size = _layout()[2]
+        if replace:
+            try:
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            raise FileExistsError('state bus {0} exists: another writer is '
+                                  'running, or pass replace=True to take '
+                                  'over a stale segment'.format(name))
+        _Segment.__init__(self, shm)
+        self.name = name
+        self.header[1] = len(INSTRUMENT_FIELDS)
+        self.header[2] = len(CONTROL_FIELDS)
+        self.header[0] = 0
+        self.seq = 0
+        self.controls_values = operator.attrgetter(*CONTROL_FIELDS)
+
+    def publish(self, instr, controls):
+
+        # instr: Instruments
+        # controls: Controls
+
+        header = self.header
+        seq = self.seq + 1
+        header[0] = seq # odd: readers retry
+        self.instr_view[:] = memoryview(instr.values)
+        self.controls_struct.pack_into(self.controls_view, 0,
+                                       *self.controls_values(controls))
+        seq += 1
+        header[0] = seq
+        self.seq = seq
+        return seq
+
+    def close(self):
+        self.release()
+        self.shm.unlink()
+
+
+# Reader side, in any process
+
+class StateReader(_Segment):
+
+    def __init__(self, name=BUS_NAME, untrack=True):
+
+        # untrack: False in processes started from the writer process by
+        #          multiprocessing, which share its resource tracker
+
+        shm = shared_memory.SharedMemory(name)
+        if untrack:
+            _untrack(shm)
+        _Segment.__init__(self, shm)
+        if (self.header[1], self.header[2]) != \
+           (len(INSTRUMENT_FIELDS), len(CONTROL_FIELDS)):
+            self.release()
+            raise ValueError('state bus {0} has {1} instrument and {2} control'
+                             ' values, expected {3} and {4}'.format(
+                                 name, self.header[1], self.header[2],
+                                 len(INSTRUMENT_FIELDS), len(CONTROL_FIELDS)))
+        self.scratch = bytearray(self.controls_struct.size)
+        self.retries = 0  # reads started over because of a concurrent write
+
+    def sequence(self):
+
+        # Sequence number of the last publish, to poll for changes
+
+        return self.header[0] & ~1
+
+    def read(self, instr=None, controls=None):
+
+        # Copies a consistent snapshot into instr and controls (new ones
+        # when None) and returns (instr, controls, sequence number)
+
+        if instr is None:
+            instr = Instruments()
+        if controls is None:
+            controls = Controls()
+        header = self.header
+        target = memoryview(instr.values)
+        scratch = self.scratch
+        while True:
+            seq = header[0]
+            if seq & 1:
+                self.retries += 1
+                continue
+            target[:] = self.instr_view
+            scratch[:] = self.controls_view
+            if header[0] == seq:
+                break
+            self.retries += 1
+        target.release()
+        for name, value in zip(CONTROL_FIELDS,
+                               self.controls_struct.unpack(scratch)):
+            setattr(controls, name, value)
+        return instr, controls, seq
+
+    def close(self):
+        self.release()
+
+
+def _reader_process(name, duration, results):
+
+    # Benchmark reader: reads as fast as it can and checks every snapshot
+
+    import time
+    reader = StateReader(name, untrack=False)
+    instr = Instruments()
+    controls = Controls()
+    reads = torn = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        reader.read(instr, controls)
+        x = instr.values[0]
+        if any(v != x for v in instr.values) or controls.thro4 != x:
+            torn += 1
+        reads += 1
+    results.put((reads, torn, reader.retries))
+    reader.close()
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import os
+    import time
+
+    # Two states whose values are all 1 and all 2: a torn read would mix
+    # them
+
+    states = []
+    for x in (1.0, 2.0):
+        instr = Instruments()
+        instr.values[:] = array('d', [x] * len(INSTRUMENT_FIELDS))
+        controls = Controls()
+        for field in CONTROL_FIELDS:
+            setattr(controls, field, x)
+        states.append((instr, controls))
+
+    name = 'xplane-state-test-{0}'.format(os.getpid())
+    bus = StateBus(name)
+    try:
+        StateBus(name)
+        raise AssertionError('a second writer must not take over the bus')
+    except FileExistsError:
+        pass
+    bus.publish(*states[0])
+    reader = StateReader(name, untrack=False)
+    instr, controls, seq = reader.read()
+    assert seq == 2 and instr.kias == 1.0 and controls.gear == 1.0
+
+    n = 200000
+    clock = time.perf_counter
+    start = clock()
+    for step in range(n):
+        bus.publish(*states[step & 1])
+    write = (clock() - start) / n
+    start = clock()
+    for step in range(n):
+        reader.read(instr, controls)
+    read = (clock() - start) / n
+    reader.close()
+    print('same process: publish {0:.2f} us, read {1:.2f} us'
+          .format(write * 1e6, read * 1e6))
+
+    # A reader in another process while the writer publishes flat out
+
+    duration = 1.0
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_reader_process,
+                                    args=(name, duration, results))
+    child.start()
+    time.sleep(0.2) # let the reader attach
+    writes = 0
+    end = clock() + duration
+    while clock() < end:
+        bus.publish(*states[writes & 1])
+        writes += 1
+    reads, torn, retries = results.get()
+    child.join()
+    bus.close()
+    print('concurrent: {0:.0f} publishes/s, {1:.0f} reads/s, {2} retries, '
+          '{3} torn reads'.format(writes / duration, reads / duration,
+                                  retries, torn))
+    assert torn == 0
+
+    # A segment left behind by a crashed writer is only taken over on
+    # request
+
+    crashed = StateBus(name)
+    crashed.release() # gone without unlinking
+    bus = StateBus(name, replace=True)
+    bus.close()
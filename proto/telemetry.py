@@ -0,0 +1,296 @@
+# File: telemetry.py
+
+# Packet-level telemetry of the X-Plane UDP link.
+#
+# A LinkStats given to a Receiver counts every datagram as it is decoded:
+# packets and bytes per second, inter-arrival time histogram, gaps (likely
+# lost packets) and bursts, malformed datagrams and decode time. All
+# counters are plain numbers and preallocated arrays updated in place, so
+# the cost is a few additions and one bisect per packet. snapshot() gives
+# the numbers to code, report() a readable summary, and when a dump file
+# is given a line is appended every dump_period seconds. The receive loop
+# also calls tick() every iteration (or on select timeout), so an outage
+# is recorded and the dump keeps coming while no packet arrives.
+
+from array import array
+from bisect import bisect_right
+import json
+import time
+
+
+# Log-spaced histogram edges in seconds: 10 us .. 10 s, 4 bins per decade
+
+def _edges(low=1e-5, decades=6, per_decade=4):
+    return [low * 10 ** (k / float(per_decade))
+            for k in range(decades * per_decade + 1)]
+
+EDGES = _edges()
+
+
+# Histogram over the EDGES bins, with an underflow and an overflow bin
+
+class Histogram:
+
+    def __init__(self, edges=EDGES):
+        self.edges = edges
+        self.counts = array('L', bytes(array('L').itemsize * (len(edges) + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, x):
+        self.counts[bisect_right(self.edges, x)] += 1
+        self.count += 1
+        self.total += x
+        if x > self.max:
+            self.max = x
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+
+        # Upper edge of the bin holding the p-th percentile
+
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for k, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.edges[k] if k < len(self.edges) else self.max
+        return self.max
+
+    def bins(self):
+
+        # Returns [(upper edge, count)] of the non-empty bins
+
+        return [(self.edges[k] if k < len(self.edges) else float('inf'), n)
+                for k, n in enumerate(self.counts) if n]
+
+    def reset(self):
+        for k in range(len(self.counts)):
+            self.counts[k] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class LinkStats:
+
+    def __init__(self, clock=time.perf_counter, gap_factor=1.5,
+                 burst_factor=0.25, dump=None, dump_period=10.0):
+
+        # clock: clock giving arrival times in seconds
+        # gap_factor: an inter-arrival time above gap_factor times the
+        #             average spacing counts as a gap
+        # burst_factor: one below burst_factor times the average spacing
+        #             counts as a burst packet
+        # dump: path of a file receiving one JSON line per dump_period
+
+        self.clock = clock
+        self.gap_factor = gap_factor
+        self.burst_factor = burst_factor
+        self.dump = dump
+        self.dump_period = dump_period
+
+        self.start = None
+        self.last = None         # arrival time of the previous packet
+        self.spacing = 0.0       # moving average of the inter-arrival time
+        self.packets = 0
+        self.bytes = 0
+        self.malformed = 0
+        self.gaps = 0
+        self.lost = 0            # packets estimated missing in the gaps
+        self.bursts = 0
+        self.outages = 0         # silences seen by tick() beyond a gap
+        self.in_outage = False
+        self.longest_outage = 0.0
+        self.inter_arrival = Histogram()
+        self.decode_time = Histogram()
+
+        self.window_start = None # counters at the start of the dump window
+        self.window_packets = 0
+        self.window_bytes = 0
+
+    def packet(self, arrival, size, decode_time, malformed=False):
+
+        # arrival: time the datagram was read
+        # size: datagram size in bytes
+        # decode_time: seconds spent decoding it
+
+        if self.start is None:
+            self.start = self.window_start = arrival
+        else:
+            dt = arrival - self.last
+            self.inter_arrival.add(dt)
+            spacing = self.spacing
+            if spacing:
+                if dt > self.gap_factor * spacing:
+                    self.gaps += 1
+                    self.lost += int(dt / spacing + 0.5) - 1
+                elif dt < self.burst_factor * spacing:
+                    self.bursts += 1
+                self.spacing = spacing + 0.05 * (dt - spacing)
+            else:
+                self.spacing = dt
+        self.last = arrival
+        self.in_outage = False
+        self.packets += 1
+        self.bytes += size
+        if malformed:
+            self.malformed += 1
+        self.decode_time.add(decode_time)
+
+        if self.dump is not None and \
+           arrival - self.window_start >= self.dump_period:
+            self.write_dump(arrival)
+
+    def tick(self, now=None):
+
+        # Time-driven part, for the receive loop to call whether or not a
+        # packet came: records an outage in progress and writes the dump
+        # when it is due
+
+        if now is None:
+            now = self.clock()
+        if self.window_start is None:
+            self.window_start = now
+        if self.last is not None and self.spacing:
+            silence = now - self.last
+            if silence > self.gap_factor * self.spacing:
+                if not self.in_outage:
+                    self.in_outage = True
+                    self.outages += 1
+                if silence > self.longest_outage:
+                    self.longest_outage = silence
+        if self.dump is not None and \
+           now - self.window_start >= self.dump_period:
+            self.write_dump(now)
+
+    def rates(self, now=None):
+
+        # Returns packets and bytes per second since the first packet
+
+        if self.start is None:
+            return 0.0, 0.0
+        if now is None:
+            now = self.last
+        elapsed = now - self.start
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return self.packets / elapsed, self.bytes / elapsed
+
+    def snapshot(self):
+        pps, bps = self.rates()
+        ia = self.inter_arrival
+        dec = self.decode_time
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'packets_per_s': pps,
+            'bytes_per_s': bps,
+            'malformed': self.malformed,
+            'gaps': self.gaps,
+            'lost': self.lost,
+            'bursts': self.bursts,
+            'outages': self.outages,
+            'longest_outage': self.longest_outage,
+            'inter_arrival_mean': ia.mean(),
+            'inter_arrival_p50': ia.percentile(50),
+            'inter_arrival_p99': ia.percentile(99),
+            'inter_arrival_max': ia.max,
+            'inter_arrival_bins': ia.bins(),
+            'decode_mean': dec.mean(),
+            'decode_p99': dec.percentile(99),
+            'decode_max': dec.max,
+        }
+
+    def report(self):
+        s = self.snapshot()
+        return ('{packets} packets ({packets_per_s:.1f}/s, '
+                '{bytes_per_s:.0f} B/s), {malformed} malformed, {gaps} gaps '
+                '(~{lost} lost), {bursts} bursts; inter-arrival mean '
+                '{ia_mean:.2f} ms, p99 < {ia_p99:.2f} ms, max {ia_max:.2f} ms; '
+                'decode mean {dec_mean:.1f} us, max {dec_max:.1f} us'
+                .format(ia_mean=s['inter_arrival_mean'] * 1e3,
+                        ia_p99=s['inter_arrival_p99'] * 1e3,
+                        ia_max=s['inter_arrival_max'] * 1e3,
+                        dec_mean=s['decode_mean'] * 1e6,
+                        dec_max=s['decode_max'] * 1e6, **s))
+
+    def write_dump(self, now):
+
+        # Appends the counters and the rates of the last window
+
+        elapsed = now - self.window_start
+        line = self.snapshot()
+        line['time'] = now
+        line['silence'] = now - self.last if self.last is not None else None
+        line['window_packets_per_s'] = \
+            (self.packets - self.window_packets) / elapsed
+        line['window_bytes_per_s'] = (self.bytes - self.window_bytes) / elapsed
+        with open(self.dump, 'a') as out:
+            out.write(json.dumps(line) + '\n')
+        self.window_start = now
+        self.window_packets = self.packets
+        self.window_bytes = self.bytes
+
+
+if __name__ == '__main__':
+    import socket
+    from xplane import Receiver, sample_packet
+
+    # Feed a link at 50 Hz with one lost packet, one extra packet 2 ms
+    # after its predecessor and one malformed datagram through a Receiver
+
+    clock = {'now': 0.0}
+    stats = LinkStats(clock=lambda: clock['now'])
+    receiver = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
+                        telemetry=stats)
+    receiver.clock = stats.clock
+    for step in range(200):
+        if step == 100:
+            continue # lost
+        clock['now'] = step * 0.02
+        receiver.feed(sample_packet(step))
+        if step == 150:
+            clock['now'] += 0.002 # burst
+            receiver.feed(sample_packet(step))
+    clock['now'] = 200 * 0.02
+    receiver.feed(b'RREF,' + bytes(8))
+
+    s = stats.snapshot()
+    print(stats.report())
+    assert s['gaps'] == 1 and s['lost'] == 1, (s['gaps'], s['lost'])
+    assert s['bursts'] == 1 and s['malformed'] == 1
+    assert s['decode_mean'] > 0 # perf_counter, whatever the sim clock
+
+    # The link goes silent for 2 s: the loop's ticks record the outage and
+    # keep the dump going
+
+    import os
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'link.jsonl')
+    stats.dump, stats.dump_period = path, 0.5
+    stats.window_start = clock['now']
+    for k in range(1, 101):
+        clock['now'] = 200 * 0.02 + k * 0.02
+        receiver.tick()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert stats.outages == 1 and stats.longest_outage > 1.9
+    assert len(lines) == 4 and lines[-1]['window_packets_per_s'] == 0
+    assert lines[-1]['silence'] > 1.9
+    os.remove(path)
+
+    # Counting a datagram with a trailing partial group as malformed does
+    # not change what is decoded from it
+
+    truncated = sample_packet(7) + b'\x00\x00'
+    plain = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    counted = Receiver(sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
+                       telemetry=LinkStats())
+    assert plain.feed(truncated).kias == counted.feed(truncated).kias != 0
+    assert counted.telemetry.malformed == 1
@@ -0,0 +1,703 @@
+# File: xplane.py
+
+# Receive engine for X-Plane DATA@ packets.
+#
+# The scripts' receive() allocates a fresh bytes object per datagram,
+# copies the whole Instruments object and unpacks one tuple per group.
+# The Receiver below reads into one preallocated buffer with recv_into,
+# decodes through memoryviews straight into the value array of a back
+# Instruments object and then swaps it with the front one, so a
+# steady-state tick allocates no objects.
+
+from array import array
+import gc
+import socket
+import struct
+import sys
+import time
+
+from clock import platform_time
+from datagroups import (compile_setters, compile_packer, compile_incremental,
+                        control_groups, instrument_fields)
+
+
+AUTOPILOT_IP   = '0.0.0.0'
+AUTOPILOT_PORT = 50000
+XPLANE_PORT    = 49000
+
+DATA_LABEL     = b'DATA@'
+LABEL_SIZE     = 5
+GROUP_SIZE     = 36   # one 'I8f' group: id and 8 floats
+GROUP_WORDS    = 9
+MAX_GROUPS     = 113  # 5 + 113*36 = 4073 bytes, within the old 4096 limit
+RECV_SIZE      = LABEL_SIZE + MAX_GROUPS * GROUP_SIZE
+
+NOWAIT         = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Where Instruments.time comes from
+
+TIME_HOST      = 'host'    # platform_time() when the state is published
+TIME_KERNEL    = 'kernel'  # kernel receive timestamp of the newest packet,
+                           # moved into the platform_time() domain
+TIME_SIM       = 'sim'     # X-Plane total sim time (group 1 must be sent)
+
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS',
+                         35 if sys.platform.startswith('linux') else None)
+timespec_struct = struct.Struct('@qq')
+perf_counter   = time.perf_counter
+
+
+# Instruments fields in the order of Instruments.values: the two time
+# fields, then every registered group field in group order (the columns of
+# bulkdata.COLUMNS)
+
+INSTRUMENT_FIELDS = ('time', 'time_delta') + \
+                    tuple(field for field, unit in instrument_fields())
+FIELD_INDEX = dict((field, k) for k, field in enumerate(INSTRUMENT_FIELDS))
+
+
+def _field(k):
+    def get(self):
+        return self.values[k]
+    def set(self, x):
+        self.values[k] = x
+    return property(get, set)
+
+
+# All values live in one float64 array read through named properties, so a
+# snapshot is one buffer copy, a history row one slice assignment, and
+# numpy.frombuffer(instr.values) a NumPy view with no copy.
+
+class Instruments:
+
+    __slots__ = ('values',)
+
+    def __init__(self):
+        self.values = array('d', bytes(8 * len(INSTRUMENT_FIELDS)))
+        self.time = platform_time()
+
+    def copy_from(self, other):
+
+        # Overwrites every value with those of other (one memcpy)
+
+        self.values[:] = other.values
+
+    def __copy__(self):
+        instr = Instruments.__new__(Instruments)
+        instr.values = array('d', self.values)
+        return instr
+
+    def as_dict(self):
+        return dict(zip(INSTRUMENT_FIELDS, self.values))
+
+for _k, _name in enumerate(INSTRUMENT_FIELDS):
+    setattr(Instruments, _name, _field(_k))
+del _k, _name
+
+
+class Controls:
+
+    def __init__(self):
+        self.gear       = 1
+        self.wbrak      = 0
+        self.lbrak      = 0
+        self.rbrak      = 0
+        self.elev       = 0
+        self.ailrn      = 0
+        self.ruddr      = 0
+        self.nose       = 0
+        self.thro1      = 0
+        self.thro2      = 0
+        self.thro3      = 0
+        self.thro4      = 0
+        self.trim_elev  = 0
+        self.trim_ailrn = 0
+        self.trim_ruddr = 0
+        self.flap       = 0
+        self.sbrak      = 0
+
+
+# Receives DATA@ packets into a preallocated buffer and decodes them into
+# a double-buffered Instruments
+
+class Receiver:
+
+    def __init__(self, ip=AUTOPILOT_IP, port=AUTOPILOT_PORT, sock=None,
+                 drain=False, time_source=TIME_HOST, telemetry=None):
+
+        # ip, port: address to bind when no socket is supplied
+        # sock: an already bound UDP socket (optional)
+        # drain: when true, receive() reads every queued datagram and keeps
+        #        the newest value of each group, see drain()
+        # time_source: TIME_HOST, TIME_KERNEL or TIME_SIM, the clock giving
+        #        Instruments.time and time_delta
+        # telemetry: telemetry.LinkStats counting every datagram (optional);
+        #        call tick() when the loop wakes up without a packet
+
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((ip, port))
+        self.sock = sock
+        self.peer = None  # (ip, port) of X-Plane, known after first packet
+        self.drain_mode = drain
+
+        # Kernel timestamps come with each datagram through recvmsg; fall
+        # back on the host clock where SO_TIMESTAMPNS is not available.
+        # They are CLOCK_REALTIME (epoch) values, converted with the
+        # offset sampled by sync_clock() so that Instruments.time is in
+        # the platform_time() domain whatever the time source. The offset
+        # is sampled again every sync_period seconds, and at once when a
+        # stamp lands in the future, so a step of the realtime clock (NTP)
+        # does not shift the stamps for good.
+
+        self.stamp = 0.0  # kernel timestamp of the last datagram read
+        if time_source == TIME_KERNEL:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.ancsize = socket.CMSG_SPACE(timespec_struct.size)
+            except (TypeError, AttributeError, OSError):
+                time_source = TIME_HOST
+        self.time_source = time_source
+        self.telemetry = telemetry
+        self.clock = platform_time
+        self.clock_offset = 0.0   # time.time() - self.clock()
+        self.sync_period = 10.0   # seconds between offset samples
+        self.synced_at = 0.0
+        self.syncs = 0
+        if time_source == TIME_KERNEL:
+            self.sync_clock()
+
+        self.buf = bytearray(RECV_SIZE)
+        view = memoryview(self.buf)
+        payload = view[LABEL_SIZE:]
+        self.ids = payload.cast('I')   # group id at word 9*g
+        self.setters = compile_setters(index=FIELD_INDEX)
+        self.buffers = [self.buf]      # for recvmsg_into
+
+        self.front = Instruments()     # last complete state, read by pilot
+        self.back = Instruments()      # state being decoded
+        self.packets = 0               # datagrams received
+        self.ticks = 0                 # states published
+        self.stale = 0                 # datagrams skipped by the last drain
+        self.stale_total = 0
+        self.stale_max = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def sync_clock(self, samples=5):
+
+        # Samples the offset between the realtime clock of the kernel
+        # timestamps and self.clock, from the tightest of a few readings.
+        # Call again after replacing the clock (clock.set_clock).
+
+        best = None
+        for k in range(samples):
+            before = self.clock()
+            now = time.time()
+            after = self.clock()
+            if best is None or after - before < best[0]:
+                best = (after - before, now - (before + after) / 2)
+        self.clock_offset = best[1]
+        self.synced_at = self.clock()
+        self.syncs += 1
+
+    def receive(self):
+
+        # Blocks for one datagram, decodes it and returns the new front
+        # Instruments. The previous front object becomes the back buffer,
+        # so callers must not keep references across ticks.
+
+        if self.drain_mode:
+            return self.drain()
+        return self.decode(self.recv())
+
+    def recv(self):
+
+        # Blocks for one datagram and returns its size
+
+        if self.time_source == TIME_KERNEL:
+            return self.recv_stamped(0)
+        if self.peer is None:
+            n, self.peer = self.sock.recvfrom_into(self.buf)
+            return n
+        return self.sock.recv_into(self.buf)
+
+    def recv_nowait(self):
+
+        # Returns the size of the next queued datagram, 0 if there is none
+
+        if self.time_source == TIME_KERNEL and NOWAIT:
+            try:
+                return self.recv_stamped(NOWAIT)
+            except BlockingIOError:
+                return 0
+        if self.peer is None:
+            try:
+                self.sock.setblocking(False)
+                n, self.peer = self.sock.recvfrom_into(self.buf)
+                return n
+            except BlockingIOError:
+                return 0
+            finally:
+                self.sock.setblocking(True)
+        try:
+            if NOWAIT:
+                return self.sock.recv_into(self.buf, 0, NOWAIT)
+            self.sock.setblocking(False)
+            try:
+                return self.sock.recv_into(self.buf)
+            finally:
+                self.sock.setblocking(True)
+        except BlockingIOError:
+            return 0
+
+    def recv_stamped(self, flags):
+
+        # Reads one datagram with recvmsg and keeps its kernel timestamp
+
+        n, ancdata, msg_flags, self.peer = self.sock.recvmsg_into(
+            self.buffers, self.ancsize, flags)
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                sec, nsec = timespec_struct.unpack_from(data)
+                stamp = (sec - self.clock_offset) + nsec * 1e-9
+                now = self.clock()
+                if stamp > now or now - self.synced_at > self.sync_period:
+                    self.sync_clock()
+                    stamp = (sec - self.clock_offset) + nsec * 1e-9
+                self.stamp = stamp
+        return n
+
+    def drain(self):
+
+        # Latest-wins receive: waits for one datagram, then decodes every
+        # datagram queued behind it into the back buffer before publishing
+        # once. Each group keeps the value of the newest packet carrying it,
+        # and the packets that were overtaken are counted as stale.
+
+        self.absorb(self.recv())
+        return self.publish()
+
+    def poll(self):
+
+        # Like drain() but never waits: returns the front Instruments,
+        # published anew only if datagrams were queued
+
+        n = self.recv_nowait()
+        if n:
+            self.absorb(n)
+            self.publish()
+        elif self.telemetry is not None:
+            self.telemetry.tick(self.clock())
+        return self.front
+
+    def absorb(self, n):
+
+        # Decodes the datagram of size n in the buffer and every datagram
+        # queued behind it into the back buffer
+
+        count = 0
+        while n:
+            self.decode_one(n)
+            count += 1
+            n = self.recv_nowait()
+
+        self.packets += count
+        self.stale = count - 1
+        self.stale_total += self.stale
+        if self.stale > self.stale_max:
+            self.stale_max = self.stale
+
+    def feed(self, data):
+
+        # Decodes a datagram that was received elsewhere (replay, tests)
+
+        n = min(len(data), RECV_SIZE)
+        self.buf[:n] = data[:n]
+        return self.decode(n)
+
+    def decode(self, n):
+
+        # n: number of valid bytes in the receive buffer
+
+        self.decode_one(n)
+        self.packets += 1
+        self.stale = 0
+        return self.publish()
+
+    def decode_one(self, n):
+
+        # Decodes the datagram in the buffer into the back buffer and
+        # counts it in the telemetry
+
+        telemetry = self.telemetry
+        if telemetry is None:
+            if self.buf.startswith(DATA_LABEL):
+                decode_groups(self.back, self.buf, self.ids, n, self.setters)
+            return
+
+        # Decode time on the CPU clock: self.clock may be sim or virtual time
+
+        arrival = self.stamp if self.time_source == TIME_KERNEL else \
+                  self.clock()
+        start = perf_counter()
+        data = self.buf.startswith(DATA_LABEL)
+        if data:
+            decode_groups(self.back, self.buf, self.ids, n, self.setters)
+
+        # A trailing partial group is only counted: the whole groups are
+        # decoded as without telemetry
+
+        malformed = not data or n <= LABEL_SIZE or \
+                    (n - LABEL_SIZE) % GROUP_SIZE != 0
+        telemetry.packet(arrival, n, perf_counter() - start, malformed)
+
+    def tick(self):
+
+        # Lets the telemetry see time pass without packets (outages, dumps)
+
+        if self.telemetry is not None:
+            self.telemetry.tick(self.clock())
+
+    def publish(self):
+
+        # Stamps the back buffer, swaps it with the front one and brings the
+        # new back buffer up to date so the groups missing from the next
+        # packet keep their last value
+
+        front = self.front
+        instr = self.back
+
+        source = self.time_source
+        if source == TIME_SIM:
+            instr.time = instr.totl_time
+        elif source == TIME_KERNEL and self.stamp:
+            instr.time = self.stamp
+        else:
+            instr.time = platform_time()
+        if self.ticks:
+            instr.time_delta = instr.time - front.time
+
+        self.front = instr
+        self.back = front
+        front.values[:] = instr.values
+        self.ticks += 1
+        return instr
+
+
+def decode_groups(instr, buf, ids, n, setters):
+
+    # Decodes the groups of the DATA@ datagram in buf into instr: one dict
+    # lookup per group, groups without a setter are skipped
+
+    # ids: uint32 view of buf after the label
+    # n: datagram size
+    # setters: group id -> setter, see datagroups.compile_setters
+
+    values = instr.values
+    get = setters.get
+    offset = LABEL_SIZE + 4
+    for g in range(0, (n - LABEL_SIZE) // GROUP_SIZE * GROUP_WORDS,
+                   GROUP_WORDS):
+        setter = get(ids[g])
+        if setter is not None:
+            setter(values, buf, offset)
+        offset += GROUP_SIZE
+
+
+# Sends Controls to X-Plane with the layout of the control groups registry
+
+SEND_FULL        = 'full'         # pack every group every time
+SEND_INCREMENTAL = 'incremental'  # re-encode only the changed groups
+SEND_CHANGED     = 'changed'      # send only the changed groups
+
+class Sender:
+
+    def __init__(self, sock=None, port=XPLANE_PORT, mode=SEND_INCREMENTAL,
+                 refresh=50):
+
+        # sock: UDP socket to send from (optional)
+        # port: X-Plane receive port
+        # mode: SEND_FULL, SEND_INCREMENTAL or SEND_CHANGED
+        # refresh: in SEND_CHANGED mode every group is sent again every
+        #          refresh builds (ticks), changed or not, in case one got
+        #          lost
+
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock = sock
+        self.port = port
+        self.mode = mode
+        self.refresh = refresh
+        self.pack, self.pack_into = compile_packer()
+
+        # Preassembled datagram, and a scratch one for SEND_CHANGED
+
+        self.update_full, self.update_compact = compile_incremental()
+        self.last = [None] * len(control_groups)  # values last encoded
+        size = LABEL_SIZE + GROUP_SIZE * len(control_groups)
+        self.buf = bytearray(size)
+        self.buf[:LABEL_SIZE] = DATA_LABEL
+        self.changed = bytearray(size)
+        self.changed[:LABEL_SIZE] = DATA_LABEL
+        self.changed_view = memoryview(self.changed)
+
+        self.builds = 0     # build() calls, sent or not
+        self.datagrams = 0
+        self.bytes = 0
+        self.encoded = 0  # groups encoded
+
+    def send(self, controls, ip):
+        packet = self.build(controls)
+        if packet is None:
+            return 0
+        n = self.sock.sendto(packet, (ip, self.port))
+        self.bytes += n
+        return n
+
+    def build(self, controls):
+
+        # Returns the datagram to send for controls, None if there is
+        # nothing to send
+
+        mode = self.mode
+        self.builds += 1
+        if mode == SEND_INCREMENTAL:
+            self.encoded += self.update_full(self.buf, self.last, controls)
+            packet = self.buf
+        elif mode == SEND_CHANGED:
+
+            # Only the changed groups, or all of them when a refresh is due
+
+            everything = self.refresh and self.builds % self.refresh == 0
+            size = self.update_compact(self.changed, self.last, controls,
+                                       everything)
+            if size == LABEL_SIZE:
+                return None
+            self.encoded += (size - LABEL_SIZE) // GROUP_SIZE
+            packet = self.changed_view[:size]
+        else:
+            packet = self.pack(controls)
+            self.encoded += len(self.last)
+        self.datagrams += 1
+        return packet
+
+
+def sample_packet(step=0, times=False):
+
+    # Returns a DATA@ datagram with groups 3, 13, 17 and 20 as X-Plane
+    # would send it (used by the self-checks), preceded by the times group
+    # 1 ticking 0.05 s per step when times is true
+
+    group = struct.Struct('<I8f')
+    s = float(step)
+    label = DATA_LABEL
+    if times:
+        label += group.pack(1, 0.05*s, 100+0.05*s, 0.05*s, 0, -999, 12, 4, 0)
+    return (label +
+            group.pack(3, 150+s, 149, 151, 152, -999, 172, 171, 173) +
+            group.pack(13, 0, 0, 0, 0.25, 0.25, 0, 0, 0) +
+            group.pack(17, 5, -2+s, 180, 182, -999, -999, -999, -999) +
+            group.pack(20, 47.46, -122.30, 1000+s, 567+s, 0, 1000, -999, -999))
+
+
+def measure_allocations(tick, ticks=2000, batch=50, prepare=None,
+                        warmup=100):
+
+    # Measures with tracemalloc what tick() allocates in steady state.
+    # Returns (growth, peak, blocks): bytes still held after all ticks,
+    # the largest transient allocation within one batch of ticks, and the
+    # net count of container objects allocated (gc generation 0 count,
+    # with automatic collection off).
+
+    # prepare: prepare(n) called outside the measurement before each batch
+    #          of n ticks (to queue packets...)
+
+    import tracemalloc
+
+    enabled = gc.isenabled()
+    gc.disable()
+    tracemalloc.start()
+    if prepare is not None:
+        prepare(warmup)
+    for x in range(warmup):
+        tick()
+
+    def batch_peak(fn):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        for y in range(batch):
+            fn()
+        return tracemalloc.get_traced_memory()[1] - base
+
+    start = tracemalloc.get_traced_memory()[0]
+    harness = batch_peak(lambda: None) # what the measuring loop allocates
+    peak = 0
+    blocks = 0
+    for x in range(ticks // batch):
+        if prepare is not None:
+            prepare(batch)
+        count = gc.get_count()[0]
+        peak = max(peak, batch_peak(tick) - harness)
+        blocks += gc.get_count()[0] - count
+    growth = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    if enabled:
+        gc.enable()
+    return growth, peak, blocks
+
+
+def check_allocations(ticks=2000, batch=50):
+
+    # Sends packets over the loopback interface and measures what
+    # steady-state receive ticks allocate. Returns (growth, peak, blocks)
+    # of measure_allocations(). Python still creates the float objects
+    # that hold the new values, so a tick is allocation-free when no
+    # container object is left behind (blocks <= 0), growth stays at the
+    # size of the current state and peak stays far below one datagram plus
+    # an Instruments copy.
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = rx.getsockname()
+    receiver = Receiver(sock=rx)
+    packet = sample_packet(1)
+
+    def prepare(n):
+        for x in range(n):
+            tx.sendto(packet, addr)
+
+    try:
+        return measure_allocations(receiver.receive, ticks, batch, prepare)
+    finally:
+        rx.close()
+        tx.close()
+
+
+def benchmark_send(ticks=20000):
+
+    # Builds a typical control sequence (aileron moving every tick,
+    # elevator every 25 ticks, the rest still) in every send mode and
+    # returns {mode: (us, bytes)} per tick
+
+    clock = time.perf_counter
+    results = {}
+    for mode in (SEND_FULL, SEND_INCREMENTAL, SEND_CHANGED):
+        sender = Sender(mode=mode)
+        build = sender.build
+        c = Controls()
+        c.thro1 = c.thro2 = c.thro3 = c.thro4 = 1
+        elapsed = 0.0
+        size = 0
+        for t in range(ticks):
+            c.ailrn = (t % 100) / 100.0
+            if t % 25 == 0:
+                c.elev = (t % 7) / 10.0
+            start = clock()
+            packet = build(c)
+            elapsed += clock() - start
+            if packet is not None:
+                size += len(packet)
+        sender.sock.close()
+        results[mode] = (elapsed / ticks * 1e6, size / float(ticks))
+    return results
+
+
+if __name__ == '__main__':
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r = Receiver(sock=rx)
+    i = r.feed(sample_packet(2))
+    assert (i.kias, i.roll, i.alt_agl) == (152, 0, 569), (i.kias, i.roll)
+    i = r.feed(DATA_LABEL + sample_packet(3)[LABEL_SIZE+36:LABEL_SIZE+72])
+    assert i.kias == 152 and i.flap_postn == 0.25
+
+    # Snapshots are copies of the value array
+
+    import copy
+    snap = copy.copy(i)
+    assert snap.values == i.values and snap.values is not i.values
+    assert snap.as_dict()['alt_agl'] == i.alt_agl == 569
+
+    # Sim time comes from the times group
+
+    sim = Receiver(sock=rx, time_source=TIME_SIM)
+    sim.feed(sample_packet(1, times=True))
+    i = sim.feed(sample_packet(3, times=True))
+    assert abs(i.time - 100.15) < 1e-4 and abs(i.time_delta - 0.1) < 1e-4
+
+    # Kernel timestamps give the real spacing of packets read late
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    stamped = Receiver(sock=rx, time_source=TIME_KERNEL)
+    host = Receiver(sock=rx)
+    for step in range(3):
+        rx.sendto(sample_packet(step), rx.getsockname())
+        time.sleep(0.02)
+    time.sleep(0.05)
+    for step in range(3):
+        i = stamped.receive()
+        host.feed(sample_packet(step))
+    print('time_delta: kernel {0:.4f} s, host {1:.6f} s'
+          .format(i.time_delta, host.front.time_delta))
+    if stamped.time_source == TIME_KERNEL:
+        assert 0.015 < i.time_delta < 0.1, i.time_delta
+
+        # in the same clock domain as the host stamps, a few ms in the past
+        age = platform_time() - i.time
+        assert 0 <= age < 0.5, age
+
+        # A step of the realtime clock, forward then back, is caught by a
+        # stamp in the future, then by the periodic sync
+
+        syncs = stamped.syncs
+        for step in (-5.0, 5.0):
+            stamped.clock_offset += step
+            if step > 0:
+                stamped.synced_at -= stamped.sync_period
+            rx.sendto(sample_packet(3), rx.getsockname())
+            age = platform_time() - stamped.receive().time
+            assert 0 <= age < 0.5, (step, age)
+        assert stamped.syncs == syncs + 2
+    rx.close()
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    r = Receiver(sock=rx, drain=True)
+    for step in range(5):
+        r.sock.sendto(sample_packet(step), rx.getsockname())
+    time.sleep(0.01)
+    i = r.receive()
+    assert i.kias == 154 and r.stale == 4, (i.kias, r.stale)
+    rx.close()
+
+    sender = Sender(mode=SEND_INCREMENTAL)
+    c = Controls()
+    assert bytes(sender.build(c)) == sender.pack(c)
+    c.ruddr = 0.5
+    assert bytes(sender.build(c)) == sender.pack(c)
+
+    # With steady controls SEND_CHANGED sends nothing but the full refresh
+    # every refresh ticks, which repairs a lost datagram
+
+    sender = Sender(mode=SEND_CHANGED, refresh=50)
+    full = len(sender.pack(c))
+    sizes = [len(p) if p is not None else 0
+             for p in (sender.build(c) for t in range(150))]
+    assert [t for t, n in enumerate(sizes) if n] == [0, 49, 99, 149], sizes
+    assert all(n == full for n in sizes if n)
+    for mode, (us, size) in sorted(benchmark_send().items()):
+        print('send {0}: {1:.2f} us, {2:.0f} bytes per tick'
+              .format(mode, us, size))
+
+    growth, peak, blocks = check_allocations()
+    print('steady-state ticks: {0} bytes held, {1} bytes peak, {2} '
+          'containers'.format(growth, peak, blocks))
+    # No object but the floats of the new values: no container may be
+    # allocated, nothing may grow with the tick count, and a tick must stay
+    # well below what the scripts' receive() allocates, a copy of the
+    # datagram plus a copy.copy of Instruments (about 500 bytes).
+    assert blocks <= 0, blocks
+    assert growth <= 256 and peak <= 256, (growth, peak)